@@ -106,6 +106,8 @@ class ChessClientApp:
         self.both_connected = False
 
         self.server_game = Game()
+        self.state_seq = None  # seq of the last snapshot or delta applied to server_game
+        self.resync_pending = False  # asked for a snapshot; deltas are dropped until it comes
         self.selected = None
         self.legal_squares = set()
         self.hover_square = None
@@ -201,13 +203,16 @@ class ChessClientApp:
             self.both_connected = False
             self.draw_offer_from = None
             self.rematch_votes = []
+            self.state_seq = None
+            self.resync_pending = False
             self.selected = None
             self.legal_squares = set()
             self.show_lobby_screen()
             self.client.send({"type": "list_rooms"})
 
-        elif msg_type == "game_state":
-            self.apply_game_state(msg)
+        elif msg_type in ("game_state", "move_applied"):
+            if not self.apply_game_state(msg):
+                return
             self.refresh_move_list()
             self.refresh_status()
             self.refresh_action_buttons()
@@ -244,21 +249,39 @@ class ChessClientApp:
         self.client.send({"type": "vote_rematch"})
 
     def apply_game_state(self, state):
-        game = Game()
+        # a full game_state snapshot, or a move_applied delta played on top of the last one;
+        # returns False (after asking for a snapshot) when a delta does not fit
+        if state["type"] == "move_applied":
+            if self.resync_pending:
+                return False  # the snapshot asked for covers it
+            if self.state_seq is not None and state["seq"] <= self.state_seq:
+                return False  # already in the snapshot of a resync
+            if self.apply_move_delta(state):
+                return True
+            self.state_seq = None
+            self.resync_pending = True
+            self.client.send({"type": "resync"})
+            return False
 
-        board_rows = state["board"]
-        game.board.grid = [list(row) for row in board_rows]
-        game.board.moved = dict(state.get("moved", {}))
-        game.turn = state["turn"]
+        your_color = state["your_color"]
+        state = state["state"]
+        if "fen" in state:
+            game = Game.from_fen(state["fen"])
+        else:
+            game = Game()
+            game.board.load_rows(state["board"])
+            game.board.moved = dict(state.get("moved", {}))
+            game.turn = state["turn"]
+            game.en_passant_target = state.get("en_passant_target")
         game.last_message = state.get("last_message", "")
         game.game_over = state.get("game_over", False)
         game.result = state.get("result")
         game.promotion_pending = state.get("promotion_pending")
-        game.en_passant_target = state.get("en_passant_target")
+        game.pending_promo_text = state.get("pending_promo_text")
         game.move_list = list(state.get("move_list", []))
 
         self.server_game = game
-        self.my_color = state.get("your_color", self.my_color)
+        self.my_color = your_color
         self.both_connected = state.get("both_connected", False)
 
         self.white_username_var.set(f"White: {state.get('white_username') or '-'}")
@@ -266,7 +289,9 @@ class ChessClientApp:
 
         both = state.get("both_connected", False)
         room_text = f"Room: {state.get('room_name', '-')}"
-        if not both:
+        if self.my_color is None:
+            room_text += f"  |  Watching ({state.get('spectators', 0)} spectators)"
+        elif not both:
             room_text += "  |  Waiting for second player..."
         self.room_info_var.set(room_text)
 
@@ -275,6 +300,36 @@ class ChessClientApp:
 
         self.draw_offer_from = state.get("draw_offer_from")
         self.rematch_votes = list(state.get("rematch_votes", []))
+        self.state_seq = state.get("seq")
+        self.resync_pending = False
+        return True
+
+    def apply_move_delta(self, delta):
+        if self.state_seq is None or delta["seq"] != self.state_seq + 1:
+            return False
+        game = self.server_game
+        if "promote" in delta:
+            if not game.promote(delta["promote"]):
+                return False
+        else:
+            uci = delta["move"]
+            move = game.find_legal_move(uci[:2], uci[2:4], uci[4:] or None)
+            if move is None or not game.play_move(move):
+                return False
+        if f"{game.fen_key():016x}" != delta["hash"]:
+            return False
+
+        # the server's verdict wins (it also knows the repetitions before our snapshot)
+        game.last_message = delta["last_message"]
+        game.game_over = delta["game_over"]
+        game.result = delta["result"]
+        game.promotion_pending = delta["promotion_pending"]
+        self.draw_offer_from = delta.get("draw_offer_from")
+        self.state_seq = delta["seq"]
+
+        self.selected = None
+        self.legal_squares = set()
+        return True
 
     def refresh_action_buttons(self):
         if not hasattr(self, "action_frame"):
@@ -283,8 +338,8 @@ class ChessClientApp:
         for widget in self.action_frame.winfo_children():
             widget.pack_forget()
 
-        # Waiting for second player
-        if not self.both_connected:
+        # Spectating, or waiting for second player
+        if self.my_color is None or not self.both_connected:
             self.leave_room_btn.pack(side="left", padx=6)
             return
 
@@ -425,7 +480,10 @@ class ChessClientApp:
         scroll.pack(side="left", fill="y")
         self.rooms_listbox.config(yscrollcommand=scroll.set)
 
-        tk.Button(frame, text="Join Selected Room", command=self.on_join_selected_room).pack(pady=8)
+        buttons = tk.Frame(frame)
+        buttons.pack(pady=8)
+        tk.Button(buttons, text="Join Selected Room", command=self.on_join_selected_room).pack(side="left", padx=5)
+        tk.Button(buttons, text="Watch Selected Room", command=self.on_spectate_selected_room).pack(side="left", padx=5)
 
     def refresh_room_listbox(self):
         if not hasattr(self, "rooms_listbox"):
@@ -437,7 +495,8 @@ class ChessClientApp:
                 f"ID {room['room_id']} | {room['name']} | "
                 f"Players: {room['players']}/2 | "
                 f"White: {room.get('white_username') or '-'} | "
-                f"Black: {room.get('black_username') or '-'}"
+                f"Black: {room.get('black_username') or '-'} | "
+                f"Watching: {room.get('spectators', 0)}"
             )
             self.rooms_listbox.insert(tk.END, text)
 
@@ -461,6 +520,18 @@ class ChessClientApp:
             "room_id": room["room_id"]
         })
 
+    def on_spectate_selected_room(self):
+        selection = self.rooms_listbox.curselection()
+        if not selection:
+            messagebox.showinfo("Watch Room", "Select a room first.")
+            return
+
+        room = self.rooms_cache[selection[0]]
+        self.client.send({
+            "type": "spectate",
+            "room_id": room["room_id"]
+        })
+
     def on_new_game_click(self):
         if not self.server_game.game_over:
             messagebox.showinfo("New Game", "You can only start a new game after the current game is finished.")
@@ -828,14 +899,9 @@ class ChessClientApp:
 
         checked_king_square = None
         if self.server_game.in_check_now(self.server_game.turn) and not self.server_game.game_over:
-            king_char = "K" if self.server_game.turn == "white" else "k"
-            for r in range(8):
-                for c in range(8):
-                    if self.server_game.board.grid[r][c] == king_char:
-                        checked_king_square = self.row_col_to_square(r, c)
-                        break
-                if checked_king_square:
-                    break
+            king_index = self.server_game.board.king_squares[self.server_game.turn]
+            if king_index is not None:
+                checked_king_square = self.row_col_to_square(*divmod(king_index, 8))
 
         for display_row in range(8):
             for display_col in range(8):
@@ -1,22 +1,33 @@
+import argparse
+import asyncio
 import socket
 import threading
 import json
+import queue
+import struct
+import sys
+import time
 import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-from engine import Game
+from engine import Game, move_to_uci
 from database import init_db, login, signup
+from bots import DEFAULT_BOT_TIME, BotPlayer, BotScheduler, search_job_for
+from analysis import MAX_LINES, AnalysisService, game_from_snapshot
+from pgn import game_to_pgn
 
 HOST = "0.0.0.0"
 PORT = 5000
-
-
-def send_json(sock, data, lock=None):
-    raw = (json.dumps(data) + "\n").encode("utf-8")
-    if lock:
-        with lock:
-            sock.sendall(raw)
-    else:
-        sock.sendall(raw)
+GAME_WORKERS = 8  # asyncio mode: threads running message handlers (engine work)
+AUTH_WORKERS = 2  # asyncio mode: threads for signup/login, whose PBKDF2 hashing takes ~0.1s each
+AUTH_MESSAGES = {"signup", "login"}
+MAX_LINE = 64 * 1024  # asyncio mode: longest accepted request line
+OUTBOUND_LIMIT = 64  # frames queued per session before stale game_state frames are coalesced
+OUTBOUND_HARD_LIMIT = 256  # a client this far behind is disconnected at once
+STUCK_TIMEOUT = 10.0  # seconds a client may stay over OUTBOUND_LIMIT (or blocked in one write)
+FANOUT_CHUNK = 256  # asyncio mode: spectators written per event loop step
+SPECTATOR_DELTAS = 32  # moves a late spectator replays on top of the cached keyframe before a new one is encoded
 
 
 def recv_json_line(file_obj):
@@ -26,8 +37,134 @@ def recv_json_line(file_obj):
     return json.loads(line.strip())
 
 
+def state_frame(encoded_state, color):
+    # game_state line: an envelope with the recipient's color around the shared state,
+    # which is encoded once and reused as is for every recipient
+    return f'{{"type": "game_state", "your_color": {json.dumps(color)}, "state": {encoded_state}}}\n'.encode("utf-8")
+
+
+class OutboundQueue:
+    """Bounded queue of encoded frames between the handlers (any thread) and a
+    session's writer. put() never blocks, so a broadcast under room.lock only
+    enqueues; a slow client falls behind on its own queue."""
+
+    def __init__(self):
+        self.frames = deque()  # (message type, encoded line)
+        self.cond = threading.Condition()
+        self.over_since = None  # time.monotonic() when the queue went over OUTBOUND_LIMIT
+        self.closed = False
+        self.coalesced = 0
+
+    def put(self, data):
+        return self.put_frame(data.get("type"), (json.dumps(data) + "\n").encode("utf-8"))
+
+    def put_frame(self, kind, frame):
+        # False if the client is stuck and should be disconnected
+        with self.cond:
+            if self.closed:
+                return True
+            if len(self.frames) >= OUTBOUND_LIMIT:
+                self._coalesce(kind == "game_state")
+            if len(self.frames) >= OUTBOUND_LIMIT:
+                now = time.monotonic()
+                if self.over_since is None:
+                    self.over_since = now
+                if len(self.frames) >= OUTBOUND_HARD_LIMIT or now - self.over_since > STUCK_TIMEOUT:
+                    # reported once; later puts see a closed queue
+                    self.closed = True
+                    self.frames.clear()
+                    self.cond.notify()
+                    return False
+            else:
+                self.over_since = None
+            self.frames.append((kind, frame))
+            self.cond.notify()
+        return True
+
+    def _coalesce(self, incoming_state):
+        # every snapshot is complete: game_state and move_applied frames older than the
+        # newest game_state are not worth sending (deltas after it still are)
+        if incoming_state:
+            newest = len(self.frames)
+        else:
+            newest = max((i for i, (kind, _) in enumerate(self.frames) if kind == "game_state"), default=0)
+        stale = {i for i, (kind, _) in enumerate(self.frames)
+                 if i < newest and kind in ("game_state", "move_applied")}
+        if stale:
+            self.frames = deque(f for i, f in enumerate(self.frames) if i not in stale)
+            self.coalesced += len(stale)
+
+    def take_all(self, block=True):
+        """All queued frames; [] if none (block=False), None once closed and drained."""
+        with self.cond:
+            while block and not self.frames and not self.closed:
+                self.cond.wait()
+            if not self.frames:
+                return None if self.closed else []
+            frames = [frame for _, frame in self.frames]
+            self.frames.clear()
+            return frames
+
+    def close(self, discard=False):
+        with self.cond:
+            self.closed = True
+            if discard:
+                self.frames.clear()
+            self.cond.notify()
+
+
+class SpectatorFanout:
+    """Copies broadcast frames to spectators off the room lock: push() holds it for a
+    single queue append however many spectators there are. Jobs are delivered one
+    at a time, so every spectator gets a room's frames in broadcast order.
+
+    Threaded mode uses one fan-out thread. In asyncio mode the frames are written on
+    the event loop, FANOUT_CHUNK sessions per step, so the players' I/O is served
+    between the chunks of a big room.
+    """
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.jobs = queue.Queue()  # threaded mode
+        self.pending = deque()  # asyncio mode: [job, next session index], used on the loop only
+        if loop is None:
+            threading.Thread(target=self._run, daemon=True, name="fanout").start()
+
+    def push(self, sessions, kind, frame):
+        if not sessions:
+            return
+        if self.loop is None:
+            self.jobs.put((sessions, kind, frame))
+        else:
+            self.loop.call_soon_threadsafe(self._schedule, (sessions, kind, frame))
+
+    def _run(self):
+        while True:
+            sessions, kind, frame = self.jobs.get()
+            for sess in sessions:
+                sess.send_frame(kind, frame)
+
+    def _schedule(self, job):
+        self.pending.append([job, 0])
+        if len(self.pending) == 1:
+            self._deliver()
+
+    def _deliver(self):
+        entry = self.pending[0]
+        (sessions, kind, frame), start = entry
+        end = start + FANOUT_CHUNK
+        for sess in sessions[start:end]:
+            sess.deliver(kind, frame)
+        if end < len(sessions):
+            entry[1] = end
+        else:
+            self.pending.popleft()
+        if self.pending:
+            self.loop.call_soon(self._deliver)
+
+
 class Room:
-    def __init__(self, room_id, name, owner_session):
+    def __init__(self, room_id, name, owner_session, fanout):
         self.room_id = room_id
         self.name = name
         self.game = Game()
@@ -36,6 +173,25 @@ class Room:
 
         self.rematch_votes = set()
         self.draw_offer_from = None
+        self.bot = None  # BotPlayer when one side is the engine
+        self.human_move = None  # from+to of a human promotion waiting for its piece
+        self.seq = 0  # state version: bumped by every game_state / move_applied broadcast
+        self.encoded_seq = None  # seq the cached snapshot encoding below belongs to
+        self.encoded_state = None  # JSON of shared_state()
+        self.encoded_frames = {}  # your_color -> complete game_state line
+
+        # spectators: replaced, never mutated, so a broadcast hands the fan-out the
+        # current tuple instead of copying it under the lock
+        self.spectators = ()
+        self.fanout = fanout
+        self.keyframe = None  # (seq, compact game_state line) late spectators start from
+        self.keyframe_deltas = []  # move_applied lines since the keyframe
+
+    def bot_color(self):
+        for color in ("white", "black"):
+            if self.bot is not None and self.players[color] is self.bot:
+                return color
+        return None
 
     def player_count(self):
         return sum(1 for p in self.players.values() if p is not None)
@@ -53,42 +209,113 @@ class Room:
             "black": self.players["black"].username if self.players["black"] else None,
         }
 
-    def snapshot_for(self, session):
-        board_rows = ["".join(row) for row in self.game.board.grid]
-        users = self.usernames()
-
-        your_color = None
+    def color_of(self, session):
         if self.players["white"] is session:
-            your_color = "white"
-        elif self.players["black"] is session:
-            your_color = "black"
+            return "white"
+        if self.players["black"] is session:
+            return "black"
+        return None
 
-        return {
-            "type": "game_state",
+    def shared_state(self, compact=False):
+        # the game_state fields every recipient gets; snapshot_frame wraps them with your_color.
+        # compact leaves out board, moved and en_passant_target, which "fen" also carries
+        users = self.usernames()
+
+        state = {
             "room_id": self.room_id,
             "room_name": self.name,
-            "board": board_rows,
-            "moved": self.game.board.moved,
+            "fen": self.game.to_fen(),
             "turn": self.game.turn,
             "last_message": self.game.last_message,
             "game_over": self.game.game_over,
             "result": self.game.result,
             "promotion_pending": self.game.promotion_pending,
-            "en_passant_target": self.game.en_passant_target,
+            "pending_promo_text": self.game.pending_promo_text,
             "move_list": self.game.move_list,
             "white_username": users["white"],
             "black_username": users["black"],
-            "your_color": your_color,
             "both_connected": self.both_players_connected(),
             "draw_offer_from": self.draw_offer_from,
             "rematch_votes": list(self.rematch_votes),
+            "spectators": len(self.spectators),
+            "seq": self.seq,
+            "hash": f"{self.game.fen_key():016x}",
         }
+        if not compact:
+            state["board"] = ["".join(row) for row in self.game.board.grid]
+            state["moved"] = self.game.board.moved
+            state["en_passant_target"] = self.game.en_passant_target
+        return state
+
+    def snapshot_frame(self, color):
+        """Encoded game_state line for a player color, or for spectators when color is None
+        (caller holds self.lock).
+
+        The shared state is encoded once per seq, which every mutation bumps by
+        broadcasting; each recipient gets it inside its own small envelope.
+        """
+        if self.encoded_seq != self.seq:
+            self.encoded_state = json.dumps(self.shared_state())
+            self.encoded_frames = {}
+            self.encoded_seq = self.seq
+        frame = self.encoded_frames.get(color)
+        if frame is None:
+            frame = state_frame(self.encoded_state, color)
+            self.encoded_frames[color] = frame
+        return frame
+
+    def spectator_start(self):
+        """Lines that bring a new spectator up to date: the compact keyframe and the
+        deltas since. Re-encoded only after a full broadcast or SPECTATOR_DELTAS moves,
+        so a crowd joining at once costs one encode."""
+        if self.keyframe is None or len(self.keyframe_deltas) >= SPECTATOR_DELTAS:
+            self.keyframe = (self.seq, state_frame(json.dumps(self.shared_state(compact=True)), None))
+            self.keyframe_deltas = []
+        return [("game_state", self.keyframe[1])] + [("move_applied", frame) for frame in self.keyframe_deltas]
 
     def broadcast_state(self):
+        # full snapshot: joins, resets, draw and rematch votes, surrender
+        self.seq += 1
+        self.keyframe = None  # deltas cannot carry what changed
+        for color in ("white", "black"):
+            sess = self.players[color]
+            if sess is not None:
+                sess.send_frame("game_state", self.snapshot_frame(color))
+        if self.spectators:
+            self.fanout.push(self.spectators, "game_state", self.snapshot_frame(None))
+
+    def broadcast_move(self, change):
+        """Send a move as a move_applied delta instead of a snapshot.
+
+        change is {"move": uci} for a played move ("e7e8" leaves the promotion
+        pending) or {"promote": letter} for the piece of a pending promotion.
+        Clients replay it on their own Game and check "hash" against Game.fen_key.
+        """
+        self.seq += 1
+        game = self.game
+        delta = {
+            "type": "move_applied",
+            "room_id": self.room_id,
+            "seq": self.seq,
+            **change,
+            "turn": game.turn,
+            "last_message": game.last_message,
+            "game_over": game.game_over,
+            "result": game.result,
+            "promotion_pending": game.promotion_pending,
+            "draw_offer_from": self.draw_offer_from,
+            "hash": f"{game.fen_key():016x}",
+        }
+        frame = (json.dumps(delta) + "\n").encode("utf-8")
         for color in ("white", "black"):
             sess = self.players[color]
             if sess is not None:
-                sess.send(self.snapshot_for(sess))
+                sess.send_frame("move_applied", frame)
+        self.fanout.push(self.spectators, "move_applied", frame)
+        if self.keyframe is not None:
+            self.keyframe_deltas.append(frame)
+            if len(self.keyframe_deltas) > SPECTATOR_DELTAS:
+                self.keyframe = None
 
 
 class ClientSession:
@@ -97,18 +324,52 @@ class ClientSession:
         self.sock = sock
         self.addr = addr
         self.file = sock.makefile("r", encoding="utf-8")
-        self.send_lock = threading.Lock()
+        # a send that makes no progress for STUCK_TIMEOUT fails instead of blocking the
+        # writer forever (a send-only timeout: reads still wait as long as the client idles)
+        if sys.platform == "win32":
+            send_timeout = struct.pack("L", int(STUCK_TIMEOUT * 1000))
+        else:
+            send_timeout = struct.pack("ll", int(STUCK_TIMEOUT), 0)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, send_timeout)
+        self.outbound = OutboundQueue()
+        self.users = 2  # reader and writer; the socket is closed when both are done
+        self.users_lock = threading.Lock()
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
 
         self.username = None
         self.room = None
+        self.watching = None  # Room this session spectates
 
     def send(self, data):
-        try:
-            send_json(self.sock, data, self.send_lock)
-        except Exception:
-            pass
+        if not self.outbound.put(data):
+            self.disconnect()
 
-    def close(self):
+    def send_frame(self, kind, frame):
+        # an already encoded line, shared between the recipients of a broadcast
+        if not self.outbound.put_frame(kind, frame):
+            self.disconnect()
+
+    def _write_loop(self):
+        while True:
+            frames = self.outbound.take_all()
+            if frames is None:
+                break
+            try:
+                self.sock.sendall(b"".join(frames))
+            except BlockingIOError:
+                self.disconnect()  # SO_SNDTIMEO ran out: blocked in one write
+                break
+            except OSError:
+                self.outbound.close(discard=True)
+                break
+        self._release()
+
+    def _release(self):
+        with self.users_lock:
+            self.users -= 1
+            if self.users:
+                return
         try:
             self.file.close()
         except Exception:
@@ -118,30 +379,134 @@ class ClientSession:
         except Exception:
             pass
 
+    def disconnect(self):
+        # stuck client: drop what is queued and shut the socket down, which ends the
+        # writer's sendall and the reader's readline; cleanup runs on the reader thread
+        print(f"Disconnecting stuck client {self.addr} ({self.outbound.coalesced} frames coalesced)")
+        self.outbound.close(discard=True)
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        # called when the reader is done; the writer sends whatever is still queued
+        self.outbound.close()
+        self._release()
+
+
+class AsyncClientSession:
+    """ClientSession for the asyncio server. send() may be called from any thread
+    (handlers run in executors, bot moves arrive on scheduler threads); the write
+    itself always happens in write_loop() on the event loop."""
+
+    def __init__(self, server, reader, writer, loop):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        self.addr = writer.get_extra_info("peername")
+        self.outbound = OutboundQueue()
+        self.wakeup = asyncio.Event()
+
+        self.username = None
+        self.room = None
+        self.watching = None  # Room this session spectates
+
+    def send(self, data):
+        self.send_frame(data.get("type"), (json.dumps(data) + "\n").encode("utf-8"))
+
+    def send_frame(self, kind, frame):
+        if not self.outbound.put_frame(kind, frame):
+            self.disconnect()
+        else:
+            self._wake()
+
+    def deliver(self, kind, frame):
+        # fan-out, on the event loop: straight to the transport while nothing is
+        # queued or buffered, otherwise through the queue like any other frame
+        if (not self.outbound.frames and not self.outbound.closed
+                and not self.writer.is_closing() and not self.writer.transport.get_write_buffer_size()):
+            self.writer.write(frame)
+        elif self.outbound.put_frame(kind, frame):
+            self.wakeup.set()
+        else:
+            self.disconnect()
+
+    def _wake(self):
+        try:
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+        except RuntimeError:
+            pass  # event loop already closed
+
+    async def write_loop(self):
+        try:
+            while True:
+                frames = self.outbound.take_all(block=False)
+                if frames is None:
+                    break  # closed and everything sent
+                if not frames:
+                    await self.wakeup.wait()
+                    self.wakeup.clear()
+                    continue
+                self.writer.write(b"".join(frames))
+                # drain() waits while the transport buffer is over its high-water mark
+                await asyncio.wait_for(self.writer.drain(), STUCK_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"Disconnecting stuck client {self.addr} ({self.outbound.coalesced} frames coalesced)")
+            self.outbound.close(discard=True)
+            self.writer.transport.abort()
+        except (ConnectionError, OSError):
+            self.outbound.close(discard=True)
+        self.writer.close()
+
+    def disconnect(self):
+        print(f"Disconnecting stuck client {self.addr} ({self.outbound.coalesced} frames coalesced)")
+        self.outbound.close(discard=True)
+        try:
+            self.loop.call_soon_threadsafe(self.writer.transport.abort)
+        except RuntimeError:
+            pass
+
+    def close(self):
+        # write_loop sends whatever is still queued, then closes the writer
+        self.outbound.close()
+        self._wake()
+
 
 class ChessServer:
     def __init__(self, host, port):
         self.host = host
         self.port = port
 
-        self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_sock = None
+        self.game_executor = None  # asyncio mode only
+        self.auth_executor = None
 
         self.global_lock = threading.Lock()
         self.rooms = {}
         self.next_room_id = 1
         self.logged_in_users = set()
+        self.fanout = None  # SpectatorFanout of the mode started
+        self.bot_scheduler = BotScheduler()
+        self.analysis = AnalysisService(self.bot_scheduler)
 
+    # --- threaded mode: one thread per connection ---
     def start(self):
         init_db()
+        self.bot_scheduler.start()
+        self.fanout = SpectatorFanout()
 
+        self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.server_sock.bind((self.host, self.port))
         self.server_sock.listen()
 
-        print(f"Server listening on {self.host}:{self.port}")
+        print(f"Server listening on {self.host}:{self.port} (threaded)")
 
         while True:
             client_sock, addr = self.server_sock.accept()
+            client_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # as asyncio does
             session = ClientSession(self, client_sock, addr)
             threading.Thread(target=self.handle_client, args=(session,), daemon=True).start()
 
@@ -154,54 +519,119 @@ class ChessServer:
                 msg = recv_json_line(session.file)
                 if msg is None:
                     break
+                self.dispatch(session, msg)
 
-                msg_type = msg.get("type")
+        except ConnectionError:
+            pass  # reset or broken pipe: the client just went away
+        except Exception as e:
+            print(f"Client error {session.addr}: {e}")
+            traceback.print_exc()
+        finally:
+            self.cleanup_session(session)
+            print(f"Client disconnected: {session.addr}")
+    # -------------------------------------------------
 
-                if msg_type == "signup":
-                    self.handle_signup(session, msg)
+    # --- asyncio mode: one coroutine per connection, handlers in thread pools ---
+    def start_async(self):
+        asyncio.run(self._serve_async())
 
-                elif msg_type == "login":
-                    self.handle_login(session, msg)
+    async def _serve_async(self):
+        init_db()
+        self.bot_scheduler.start()
+        self.fanout = SpectatorFanout(asyncio.get_running_loop())
+        self.game_executor = ThreadPoolExecutor(GAME_WORKERS, thread_name_prefix="game")
+        self.auth_executor = ThreadPoolExecutor(AUTH_WORKERS, thread_name_prefix="auth")
+        server = await asyncio.start_server(self.handle_client_async, self.host, self.port,
+                                            limit=MAX_LINE, reuse_address=True)
+        print(f"Server listening on {self.host}:{self.port} (asyncio)")
+        async with server:
+            await server.serve_forever()
+
+    async def handle_client_async(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        session = AsyncClientSession(self, reader, writer, loop)
+        writing = loop.create_task(session.write_loop())
+        print(f"Client connected: {session.addr}")
+        try:
+            session.send({"type": "info", "message": "Connected to server."})
 
-                elif msg_type == "list_rooms":
-                    self.handle_list_rooms(session)
+            while True:
+                line = await reader.readline()
+                if not line.endswith(b"\n"):
+                    break  # EOF, possibly mid-line after a stuck-client abort
+                msg = json.loads(line)
+                # one message at a time per session, as in threaded mode; the handlers
+                # block on room locks and the engine, so they never run on the loop itself
+                executor = self.auth_executor if msg.get("type") in AUTH_MESSAGES else self.game_executor
+                await loop.run_in_executor(executor, self.dispatch, session, msg)
+
+        except ConnectionError:
+            pass  # reset or broken pipe: the client just went away
+        except Exception as e:
+            print(f"Client error {session.addr}: {e}")
+            traceback.print_exc()
+        finally:
+            await loop.run_in_executor(self.game_executor, self.cleanup_session, session)
+            await writing
+            print(f"Client disconnected: {session.addr}")
+    # ----------------------------------------------------------------------------
 
-                elif msg_type == "create_room":
-                    self.handle_create_room(session, msg)
+    def dispatch(self, session, msg):
+        msg_type = msg.get("type")
 
-                elif msg_type == "join_room":
-                    self.handle_join_room(session, msg)
+        if msg_type == "signup":
+            self.handle_signup(session, msg)
 
-                elif msg_type == "leave_room":
-                    self.handle_leave_room(session)
+        elif msg_type == "login":
+            self.handle_login(session, msg)
 
-                elif msg_type == "make_move":
-                    self.handle_make_move(session, msg)
+        elif msg_type == "list_rooms":
+            self.handle_list_rooms(session)
 
-                elif msg_type == "promote":
-                    self.handle_promote(session, msg)
+        elif msg_type == "create_room":
+            self.handle_create_room(session, msg)
 
-                elif msg_type == "surrender":
-                    self.handle_surrender(session)
+        elif msg_type == "join_room":
+            self.handle_join_room(session, msg)
 
-                elif msg_type == "offer_draw":
-                    self.handle_offer_draw(session)
+        elif msg_type == "leave_room":
+            self.handle_leave_room(session)
 
-                elif msg_type == "respond_draw":
-                    self.handle_respond_draw(session, msg)
+        elif msg_type == "make_move":
+            self.handle_make_move(session, msg)
 
-                elif msg_type == "vote_rematch":
-                    self.handle_vote_rematch(session)
+        elif msg_type == "promote":
+            self.handle_promote(session, msg)
 
-                else:
-                    session.send({"type": "error", "message": "Unknown request type."})
+        elif msg_type == "surrender":
+            self.handle_surrender(session)
 
-        except Exception as e:
-            print(f"Client error {session.addr}: {e}")
-            traceback.print_exc()
-        finally:
-            self.cleanup_session(session)
-            print(f"Client disconnected: {session.addr}")
+        elif msg_type == "offer_draw":
+            self.handle_offer_draw(session)
+
+        elif msg_type == "respond_draw":
+            self.handle_respond_draw(session, msg)
+
+        elif msg_type == "vote_rematch":
+            self.handle_vote_rematch(session)
+
+        elif msg_type == "bot_stats":
+            self.handle_bot_stats(session)
+
+        elif msg_type == "analyze":
+            self.handle_analyze(session, msg)
+
+        elif msg_type == "export_pgn":
+            self.handle_export_pgn(session)
+
+        elif msg_type == "resync":
+            self.handle_resync(session)
+
+        elif msg_type == "spectate":
+            self.handle_spectate(session, msg)
+
+        else:
+            session.send({"type": "error", "message": "Unknown request type."})
 
     def require_auth(self, session):
         if not session.username:
@@ -216,6 +646,192 @@ class ChessServer:
             return "black"
         return None
 
+    # --- bot rooms ---
+    def start_bot_move(self, room):
+        # caller holds room.lock; only queues the search, the move arrives in apply_bot_move
+        bot_color = room.bot_color()
+        game = room.game
+        if bot_color is None or game.game_over or game.promotion_pending is not None or game.turn != bot_color:
+            return
+        bot = room.bot
+        bot.generation += 1
+        generation = bot.generation
+        bot.ponder_move = None
+        bot.ponder_result = None
+        bot.ponder_hit = False
+        if bot.turn_started is None:
+            bot.turn_started = time.perf_counter()
+        self.bot_scheduler.submit(
+            room.room_id,
+            search_job_for(game, bot.time_limit),
+            lambda result, error: self.apply_bot_move(room, generation, result, error),
+        )
+
+    def start_ponder(self, room, result):
+        # caller holds room.lock; search our answer to the reply the last search expects
+        bot = room.bot
+        game = room.game
+        if not bot.ponder or game.game_over or game.promotion_pending is not None or len(result["pv"]) < 2:
+            return
+        predicted = result["pv"][1]
+        move = game.find_legal_move(predicted[:2], predicted[2:4], predicted[4:] or None)
+        if move is None:
+            return
+        bot.generation += 1
+        generation = bot.generation
+        bot.ponder_move = predicted
+        bot.ponder_since = time.time()
+        bot.ponder_result = None
+        self.bot_scheduler.submit(
+            room.room_id,
+            search_job_for(game, bot.time_limit, ponder_move=move),
+            lambda ponder_result, error: self.apply_bot_move(room, generation, ponder_result, error),
+        )
+
+    def bot_reply(self, room, move_uci):
+        # caller holds room.lock; the human just played move_uci (e.g. "e2e4", "e7e8q")
+        bot = room.bot
+        if bot is None:
+            return
+        if room.game.game_over:
+            self.stop_bot(room)
+            return
+        if room.game.turn != room.bot_color():
+            return
+
+        bot.turn_started = time.perf_counter()
+        if bot.ponder_move is not None:
+            hit = move_uci == bot.ponder_move
+            self.bot_scheduler.record_ponder(hit)
+            bot.ponder_move = None
+            if hit:
+                if bot.ponder_result is not None:
+                    result, bot.ponder_result = bot.ponder_result, None
+                    self.play_bot_result(room, result, pondered=True)
+                    return
+                if self.bot_scheduler.ponder_hit(room.room_id, bot.time_limit, bot.ponder_since):
+                    bot.ponder_hit = True
+                    return
+            else:
+                self.bot_scheduler.cancel(room.room_id)
+        self.start_bot_move(room)
+
+    def stop_bot(self, room):
+        # caller holds room.lock
+        bot = room.bot
+        if bot is not None:
+            bot.generation += 1
+            bot.ponder_move = None
+            bot.ponder_result = None
+            bot.ponder_hit = False
+            bot.turn_started = None
+            self.bot_scheduler.cancel(room.room_id)
+
+    def apply_bot_move(self, room, generation, result, error):
+        if error is not None:
+            return  # cancelled or replaced by a newer search; failures are logged by the scheduler
+        with room.lock:
+            bot = room.bot
+            if bot is None or bot.generation != generation:
+                return  # room left, game over or reset since the search started
+            if bot.ponder_move is not None:
+                bot.ponder_result = result  # pondering finished before the opponent moved
+                return
+            if room.game.game_over or room.bot_color() != room.game.turn:
+                return
+            self.play_bot_result(room, result, pondered=bot.ponder_hit)
+
+    def play_bot_result(self, room, result, pondered):
+        # caller holds room.lock
+        bot = room.bot
+        if result["move"] is None:
+            return
+        room.draw_offer_from = None
+        room.game.play_move(result["move"])
+        room.broadcast_move({"move": move_to_uci(result["move"])})
+        if bot.turn_started is not None:
+            self.bot_scheduler.record_reply(time.perf_counter() - bot.turn_started, pondered)
+            bot.turn_started = None
+        bot.ponder_hit = False
+        self.start_ponder(room, result)
+
+    def handle_bot_stats(self, session):
+        if not self.require_auth(session):
+            return
+        session.send({
+            "type": "bot_stats",
+            "stats": self.bot_scheduler.stats(),
+            "analysis": self.analysis.stats(),
+        })
+
+    def handle_analyze(self, session, msg):
+        # {"type": "analyze", "lines": 3} for the room's finished game, or with a position
+        # ("fen", or "board", "turn", "moved", "en_passant_target") when not playing a game
+        if not self.require_auth(session):
+            return
+
+        try:
+            lines = min(max(int(msg.get("lines", 3)), 1), MAX_LINES)
+        except (TypeError, ValueError):
+            session.send({"type": "error", "message": "Invalid number of lines."})
+            return
+
+        room = session.room
+        if "board" in msg or "fen" in msg:
+            if room is not None and self.get_player_color(room, session) is not None and not room.game.game_over:
+                session.send({"type": "error", "message": "Analysis is available after your game is over."})
+                return
+            game, error = game_from_snapshot(msg)
+            if error is None:
+                error = self.analysis.request(session, game, lines)
+        else:
+            if room is None:
+                session.send({"type": "error", "message": "You are not in a room."})
+                return
+            with room.lock:
+                if not room.game.game_over:
+                    error = "Analysis is available after the game is over."
+                else:
+                    error = self.analysis.request(session, room.game, lines)
+
+        if error is not None:
+            session.send({"type": "error", "message": error})
+    # -----------------
+
+    def handle_export_pgn(self, session):
+        # PGN of the room's finished game
+        room = session.room
+        if room is None:
+            session.send({"type": "error", "message": "You are not in a room."})
+            return
+        with room.lock:
+            if not room.game.game_over:
+                session.send({"type": "error", "message": "PGN export is available after the game is over."})
+                return
+            users = room.usernames()
+            text = game_to_pgn(room.game, {
+                "Event": "Online game",
+                "Site": room.name,
+                "White": users["white"] or "?",
+                "Black": users["black"] or "?",
+            })
+        session.send({"type": "pgn", "room_id": room.room_id, "pgn": text})
+
+    def handle_resync(self, session):
+        # a client whose game no longer matches a move_applied delta asks for a snapshot
+        if session.watching is not None:
+            room = session.watching
+            with room.lock:
+                for kind, frame in room.spectator_start():
+                    session.send_frame(kind, frame)
+            return
+        room = session.room
+        if room is None:
+            session.send({"type": "error", "message": "You are not in a room."})
+            return
+        with room.lock:
+            session.send_frame("game_state", room.snapshot_frame(room.color_of(session)))
+
     def handle_offer_draw(self, session):
         room = session.room
         if room is None:
@@ -248,6 +864,10 @@ class ChessServer:
             offerer = "White" if player_color == "white" else "Black"
             room.game.last_message = f"{offerer} offered a draw."
 
+            if room.bot is not None:
+                room.draw_offer_from = None
+                room.game.last_message = f"{offerer} offered a draw. The bot declined."
+
             room.broadcast_state()
 
     def handle_respond_draw(self, session, msg):
@@ -309,11 +929,15 @@ class ChessServer:
                 return
 
             room.rematch_votes.add(player_color)
+            if room.bot is not None:
+                room.rematch_votes.add(room.bot_color())
 
             if room.rematch_votes == {"white", "black"}:
                 room.game.reset()
                 room.reset_match_flow_state()
                 room.broadcast_state()
+                self.stop_bot(room)
+                self.start_bot_move(room)
                 return
 
             voter = "White" if player_color == "white" else "Black"
@@ -350,10 +974,12 @@ class ChessServer:
 
             room.game.game_over = True
             room.game.result = "surrender"
+            room.game.winner = "black" if player_color == "white" else "white"
             room.game.last_message = f"{loser} surrendered. {winner} wins."
             room.game.promotion_pending = None
             room.draw_offer_from = None
             room.rematch_votes.clear()
+            self.stop_bot(room)
 
             room.broadcast_state()
 
@@ -433,6 +1059,7 @@ class ChessServer:
                     "players": room.player_count(),
                     "white_username": users["white"],
                     "black_username": users["black"],
+                    "spectators": len(room.spectators),
                 })
 
         session.send({
@@ -444,7 +1071,7 @@ class ChessServer:
         if not self.require_auth(session):
             return
 
-        if session.room is not None:
+        if session.room is not None or session.watching is not None:
             session.send({"type": "error", "message": "Leave your current room first."})
             return
 
@@ -452,11 +1079,29 @@ class ChessServer:
         if not room_name:
             room_name = f"{session.username}'s Room"
 
+        # {"type": "create_room", "bot": true, "bot_time": 2.0, "color": "black", "ponder": true}
+        # plays against the engine
+        bot = None
+        your_color = "white"
+        if msg.get("bot"):
+            try:
+                bot = BotPlayer(msg.get("bot_time", DEFAULT_BOT_TIME), ponder=bool(msg.get("ponder")))
+            except (TypeError, ValueError):
+                session.send({"type": "error", "message": "Invalid bot time."})
+                return
+            if msg.get("color") == "black":
+                your_color = "black"
+
         with self.global_lock:
             room_id = self.next_room_id
             self.next_room_id += 1
 
-            room = Room(room_id, room_name, session)
+            room = Room(room_id, room_name, session, self.fanout)
+            if bot is not None:
+                room.bot = bot
+                bot.room = room
+                room.players[your_color] = session
+                room.players["black" if your_color == "white" else "white"] = bot
             self.rooms[room_id] = room
             session.room = room
 
@@ -464,15 +1109,17 @@ class ChessServer:
             "type": "room_joined",
             "room_id": room.room_id,
             "room_name": room.name,
-            "your_color": "white"
+            "your_color": your_color
         })
-        room.broadcast_state()
+        with room.lock:
+            room.broadcast_state()
+            self.start_bot_move(room)
 
     def handle_join_room(self, session, msg):
         if not self.require_auth(session):
             return
 
-        if session.room is not None:
+        if session.room is not None or session.watching is not None:
             session.send({"type": "error", "message": "Leave your current room first."})
             return
 
@@ -501,15 +1148,61 @@ class ChessServer:
 
             session.room = room
 
-        session.send({
-            "type": "room_joined",
-            "room_id": room.room_id,
-            "room_name": room.name,
-            "your_color": color
-        })
-        room.broadcast_state()
+            session.send({
+                "type": "room_joined",
+                "room_id": room.room_id,
+                "room_name": room.name,
+                "your_color": color
+            })
+            room.broadcast_state()
+
+    def handle_spectate(self, session, msg):
+        if not self.require_auth(session):
+            return
+
+        if session.room is not None or session.watching is not None:
+            session.send({"type": "error", "message": "Leave your current room first."})
+            return
+
+        with self.global_lock:
+            room = self.rooms.get(msg.get("room_id"))
+
+        if room is None:
+            session.send({"type": "error", "message": "Room does not exist."})
+            return
+
+        with room.lock:
+            if room.player_count() == 0:
+                session.send({"type": "error", "message": "Room does not exist."})  # closed meanwhile
+                return
+            room.spectators = room.spectators + (session,)
+            session.watching = room
+            # sent under the lock: every later broadcast reaches this session
+            # through the fan-out, after these frames
+            session.send({
+                "type": "room_joined",
+                "room_id": room.room_id,
+                "room_name": room.name,
+                "your_color": None,
+                "spectating": True,
+            })
+            for kind, frame in room.spectator_start():
+                session.send_frame(kind, frame)
+
+    def stop_spectating(self, session):
+        room = session.watching
+        if room is None:
+            return
+        with room.lock:
+            room.spectators = tuple(s for s in room.spectators if s is not session)
+            session.watching = None
+        session.send({"type": "left_room"})
 
     def handle_leave_room(self, session):
+        if session.watching is not None:
+            self.stop_spectating(session)
+            return
+
         room = session.room
         if room is None:
             return
@@ -534,6 +1227,11 @@ class ChessServer:
             room.players["black"] = None
             room.draw_offer_from = None
             room.rematch_votes.clear()
+            self.stop_bot(room)
+            room.bot = None
+            spectators, room.spectators = room.spectators, ()
+            for spectator in spectators:
+                spectator.watching = None
 
         with self.global_lock:
             if room.room_id in self.rooms:
@@ -549,6 +1247,7 @@ class ChessServer:
 
         # Tell the leaving player that they left
         session.send({"type": "left_room"})
+        self.fanout.push(spectators, "left_room", b'{"type": "left_room"}\n')
 
     def handle_make_move(self, session, msg):
         room = session.room
@@ -589,13 +1288,19 @@ class ChessServer:
                 session.send({"type": "error", "message": "It is not your turn."})
                 return
 
+            last_message = room.game.last_message
             moved = room.game.try_move(from_sq, to_sq)
             if not moved:
+                # only the mover hears about it; the shared state and seq stay as they were
                 session.send({"type": "error", "message": room.game.last_message})
-                room.broadcast_state()
+                room.game.last_message = last_message
                 return
 
-            room.broadcast_state()
+            room.broadcast_move({"move": from_sq + to_sq})
+            if room.game.promotion_pending is None:
+                self.bot_reply(room, from_sq + to_sq)
+            else:
+                room.human_move = from_sq + to_sq  # completed by handle_promote
 
     def handle_promote(self, session, msg):
         room = session.room
@@ -624,19 +1329,23 @@ class ChessServer:
                 session.send({"type": "error", "message": "It is not your turn."})
                 return
 
+            last_message = room.game.last_message
             ok = room.game.promote(piece)
             if not ok:
+                # only the mover hears about it; the shared state and seq stay as they were
                 session.send({"type": "error", "message": room.game.last_message})
-                room.broadcast_state()
+                room.game.last_message = last_message
                 return
 
-            room.broadcast_state()
+            room.broadcast_move({"promote": piece})
+            self.bot_reply(room, (room.human_move or "") + piece)
 
     def cleanup_session(self, session):
         try:
             self.handle_leave_room(session)
         except Exception:
             pass
+        self.analysis.forget_session(session)
 
         with self.global_lock:
             if session.username in self.logged_in_users:
@@ -646,4 +1355,15 @@ class ChessServer:
 
 
 if __name__ == "__main__":
-    ChessServer(HOST, PORT).start()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Chess server.")
+    parser.add_argument("--mode", choices=("threaded", "async"), default="threaded",
+                        help="one thread per connection, or one asyncio event loop")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    server = ChessServer(args.host, args.port)
+    if args.mode == "async":
+        server.start_async()
+    else:
+        server.start()
\ No newline at end of file
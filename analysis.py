@@ -0,0 +1,185 @@
+# analysis.py
+#
+# Server-side position analysis ("analyze" messages). Searches go through the
+# same BotScheduler pool as bot moves; finished results are cached by position
+# key, and requests for a position that is already being searched wait for
+# that search instead of starting another.
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+from engine import SQUARE_INDEX, Game
+from bots import search_job_for
+
+ANALYSIS_TIME = 3.0  # seconds per request, split between the lines
+ANALYSIS_DEPTH = 8
+MAX_LINES = 5
+MAX_ACTIVE_PER_SESSION = 2  # analyses one session may have waiting at once
+MAX_REQUESTS_PER_MINUTE = 20
+PIECE_CHARS = set("PNBRQKpnbrqk.")
+
+
+def game_from_snapshot(data):
+    """Game for a position sent as "fen" or in game_state form ("board" rows, "turn",
+    "moved", "en_passant_target"). Returns (game, None) or (None, error message)."""
+    if "fen" in data:
+        if not isinstance(data["fen"], str):
+            return None, "Invalid FEN."
+        try:
+            game = Game.from_fen(data["fen"])
+        except ValueError as e:
+            return None, f"Invalid FEN: {e}"
+        if game.piece_counts["K"] != 1 or game.piece_counts["k"] != 1:
+            return None, "Each side needs exactly one king."
+        return _checked_position(game)
+
+    rows = data.get("board")
+    if not isinstance(rows, list) or len(rows) != 8:
+        return None, "Board must have 8 rows."
+    for row in rows:
+        if not isinstance(row, str) or len(row) != 8 or not set(row) <= PIECE_CHARS:
+            return None, "Invalid board row."
+    text = "".join(rows)
+    if text.count("K") != 1 or text.count("k") != 1:
+        return None, "Each side needs exactly one king."
+
+    turn = data.get("turn", "white")
+    if turn not in ("white", "black"):
+        return None, "Invalid side to move."
+    en_passant = data.get("en_passant_target")
+    if en_passant is not None and (en_passant not in SQUARE_INDEX or en_passant[1] not in ("3", "6")):
+        return None, "Invalid en passant square."
+    moved = data.get("moved") or {}
+    if not isinstance(moved, dict):
+        return None, "Invalid castling flags."
+
+    game = Game()
+    game.board.load_rows(rows)
+    game.board.moved = {flag: bool(moved.get(flag, False)) for flag in game.board.moved}
+    game.turn = turn
+    game.en_passant_target = en_passant
+    game._reset_draw_bookkeeping()
+    return _checked_position(game)
+
+
+def _checked_position(game):
+    # a position where the side that just moved left its king in check can't arise
+    waiting = "black" if game.turn == "white" else "white"
+    if game.in_check_now(waiting):
+        return None, "The side not to move is in check."
+    return game, None
+
+
+class AnalysisService:
+    """LRU result cache + in-flight deduplication + per-session limits in front of a BotScheduler."""
+
+    def __init__(self, scheduler, max_entries=2000):
+        self.scheduler = scheduler
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.results = OrderedDict()  # (position key, lines) -> analysis result
+        self.waiting = {}  # (position key, lines) -> sessions waiting for the running search
+        self.active = {}  # session -> analyses it is waiting for
+        self.recent = {}  # session -> deque of request times in the last minute
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+
+    def request(self, session, game, lines):
+        """Send the analysis of game's position to session, now if cached, else when the search ends.
+
+        Call with the game's room lock held (the position is copied into a job here).
+        Returns an error message or None.
+        """
+        cache_key = (game.position_key(), lines)
+        with self.lock:
+            cached = self.results.get(cache_key)
+            if cached is not None:
+                self.results.move_to_end(cache_key)
+                self.hits += 1
+            else:
+                error = self._admit(session)
+                if error is not None:
+                    return error
+                self.active[session] = self.active.get(session, 0) + 1
+                if cache_key in self.waiting:
+                    self.waiting[cache_key].append(session)
+                    self.deduplicated += 1
+                    return None
+                self.waiting[cache_key] = [session]
+                self.misses += 1
+
+        if cached is not None:
+            session.send(self._message(cache_key, cached, True))
+            return None
+
+        job = dict(search_job_for(game, ANALYSIS_TIME), lines=lines, max_depth=ANALYSIS_DEPTH)
+        self.scheduler.submit(
+            ("analysis", cache_key), job, lambda result, error: self._finished(cache_key, result, error),
+        )
+        return None
+
+    def _admit(self, session):
+        # caller holds self.lock
+        if self.active.get(session, 0) >= MAX_ACTIVE_PER_SESSION:
+            return "Too many analyses running. Wait for the current ones to finish."
+        now = time.monotonic()
+        recent = self.recent.setdefault(session, deque())
+        while recent and now - recent[0] > 60.0:
+            recent.popleft()
+        if len(recent) >= MAX_REQUESTS_PER_MINUTE:
+            return "Analysis limit reached. Try again in a minute."
+        recent.append(now)
+        return None
+
+    def _finished(self, cache_key, result, error):
+        # scheduler callback for every search, including failed and cancelled ones:
+        # the waiting sessions always get an answer and their slots back
+        try:
+            if error is None:
+                message = self._message(cache_key, result, False)
+            else:
+                message = {"type": "error", "message": f"Analysis failed ({error})."}
+        finally:
+            with self.lock:
+                if error is None:
+                    self.results[cache_key] = result
+                    while len(self.results) > self.max_entries:
+                        self.results.popitem(last=False)
+                sessions = self.waiting.pop(cache_key, [])
+                for session in sessions:
+                    self.active[session] -= 1
+                    if not self.active[session]:
+                        del self.active[session]
+        for session in sessions:
+            session.send(message)
+
+    def forget_session(self, session):
+        with self.lock:
+            self.active.pop(session, None)
+            self.recent.pop(session, None)
+            for sessions in self.waiting.values():
+                while session in sessions:
+                    sessions.remove(session)
+
+    def _message(self, cache_key, result, cached):
+        position_key, lines = cache_key
+        return {
+            "type": "analysis",
+            "position_key": f"{position_key:016x}",
+            "lines": result["lines"][:lines],
+            "nodes": result["nodes"],
+            "seconds": result["seconds"],
+            "cached": cached,
+        }
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.results),
+                "running": len(self.waiting),
+                "hits": self.hits,
+                "misses": self.misses,
+                "deduplicated": self.deduplicated,
+            }
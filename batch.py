@@ -0,0 +1,354 @@
+# batch.py
+#
+# Whole-batch versions of the engine's attack and legality checks for offline
+# screening of large position sets. A batch is N positions as an (N, 64) int8
+# array (square index = row * 8 + col, as in engine.py) holding PIECE_CODES:
+# white pieces positive, black negative, 0 for an empty square. Every function
+# returns arrays; there is no per-square Python loop.
+#
+# Internally each position is turned so the side being looked at moves "up"
+# (towards row 0) with positive codes, and a 65th always-occupied column stands
+# in for squares off the board, so every ray lookup is one fancy-index gather.
+
+import numpy as np
+
+from engine import (
+    BISHOP_DIRECTIONS, KNIGHT_OFFSETS, ROOK_DIRECTIONS, SQUARE_INDEX, SQUARE_NAMES, _FEN_EXPAND, FEN_PIECES,
+)
+
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+PIECE_CODES = {".": 0, "P": 1, "N": 2, "B": 3, "R": 4, "Q": 5, "K": 6,
+               "p": -1, "n": -2, "b": -3, "r": -4, "q": -5, "k": -6}
+OFF_BOARD = 8  # value of the padding column: blocks rays, belongs to nobody
+CHUNK_SIZE = 1024  # positions per legality pass; bounds the temporary arrays
+
+# byte of a board row string -> piece code, and whether it is one at all
+_CODE_OF_BYTE = np.zeros(256, dtype=np.int8)
+_PIECE_BYTE = np.zeros(256, dtype=bool)
+for _piece, _code in PIECE_CODES.items():
+    _CODE_OF_BYTE[ord(_piece)] = _code
+    _PIECE_BYTE[ord(_piece)] = True
+
+# square -> 16 rays of up to 7 squares, nearest first, padded with 64:
+# 0-3 diagonal (BISHOP_DIRECTIONS order), 4-7 straight, 8-15 knight jumps (one square each)
+RAYS = np.full((64, 16, 7), 64, dtype=np.int32)
+for _index in range(64):
+    _row, _col = divmod(_index, 8)
+    for _ray, (_dr, _dc) in enumerate(BISHOP_DIRECTIONS + ROOK_DIRECTIONS + KNIGHT_OFFSETS):
+        _steps = 1 if _ray >= 8 else 7
+        for _step in range(_steps):
+            _r, _c = _row + _dr * (_step + 1), _col + _dc * (_step + 1)
+            if not (0 <= _r < 8 and 0 <= _c < 8):
+                break
+            RAYS[_index, _ray, _step] = _r * 8 + _c
+SLIDES = np.ascontiguousarray(RAYS[:, :8])  # the 8 sliding rays alone
+JUMPS = np.ascontiguousarray(RAYS[:, 8:, 0])  # the knight squares alone
+NEAR = np.ascontiguousarray(RAYS[:, :, 0])  # first square of every ray: all a pawn, knight or king can reach
+
+# piece code -> how many squares it reaches along each ray (pawns: attacks only)
+RAY_REACH = np.zeros((OFF_BOARD + 1, 16), dtype=np.int8)
+RAY_REACH[PAWN, 0:2] = 1  # (-1, -1) and (-1, 1): forward diagonals
+RAY_REACH[KNIGHT, 8:16] = 1
+RAY_REACH[BISHOP, 0:4] = 7
+RAY_REACH[ROOK, 4:8] = 7
+RAY_REACH[QUEEN, 0:8] = 7
+RAY_REACH[KING, 0:8] = 1
+_STEPS = np.arange(7, dtype=np.int8)
+
+# a board turned upside down: square -> its mirror on the other side
+_MIRROR = np.arange(64).reshape(8, 8)[::-1].ravel()
+# sliding ray -> the negative pieces that attack along it
+_SLIDERS = np.array([[-BISHOP, -QUEEN]] * 4 + [[-ROOK, -QUEEN]] * 4, dtype=np.int8)
+
+
+# --- building batches ---
+def boards_from_rows(positions):
+    """(N, 64) int8 boards from positions given as rows of piece characters each
+    (game_state "board" strings, Board.grid lists, or one 64-square sequence).
+    Raises ValueError for a wrong square count or a character that is no piece."""
+    text = "".join("".join(row) for rows in positions for row in rows)
+    data = np.frombuffer(text.encode("ascii", "replace"), dtype=np.uint8)
+    if data.size != len(positions) * 64:
+        raise ValueError("Every position needs 8 rows of 8 squares.")
+    unknown = np.flatnonzero(~_PIECE_BYTE[data])
+    if unknown.size:
+        number, index = divmod(int(unknown[0]), 64)
+        raise ValueError(f"Bad piece {text[number * 64 + index]!r} on {SQUARE_NAMES[index]} of position {number}")
+    return _CODE_OF_BYTE[data].reshape(-1, 64)
+
+
+def positions_from_fens(fens):
+    """Batch dict ("boards", "white_to_move", "castling", "en_passant") for a list of FEN strings.
+
+    castling is (N, 4) bool in FEN order K, Q, k, q; en_passant is the square index or -1.
+    Raises ValueError for malformed FEN.
+    """
+    count = len(fens)
+    placements = []
+    white_to_move = np.zeros(count, dtype=bool)
+    castling = np.zeros((count, 4), dtype=bool)
+    en_passant = np.full(count, -1, dtype=np.int8)
+    for number, fen in enumerate(fens):
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError(f"FEN needs 4-6 fields: {fen!r}")
+        placement = fields[0].translate(_FEN_EXPAND)
+        if len(placement) != 71 or placement[8::9] != "///////" or not set(placement) <= FEN_PIECES | {"/"}:
+            raise ValueError(f"Bad FEN piece placement: {fields[0]!r}")
+        if placement.count("K") != 1 or placement.count("k") != 1:
+            # the attack code finds each king with argmax, which reads a missing one as a8
+            raise ValueError(f"FEN needs one king per side: {fields[0]!r}")
+        placements.append(placement.replace("/", ""))
+        if fields[1] not in ("w", "b"):
+            raise ValueError(f"Bad FEN side to move: {fields[1]!r}")
+        white_to_move[number] = fields[1] == "w"
+        if fields[2] != "-":
+            for letter in fields[2]:
+                if letter not in "KQkq":
+                    raise ValueError(f"Bad FEN castling field: {fields[2]!r}")
+                castling[number, "KQkq".index(letter)] = True
+        if fields[3] != "-":
+            if fields[3] not in SQUARE_INDEX or fields[3][1] not in ("3", "6"):
+                raise ValueError(f"Bad FEN en passant square: {fields[3]!r}")
+            en_passant[number] = SQUARE_INDEX[fields[3]]
+    return {
+        "boards": boards_from_rows(placements),
+        "white_to_move": white_to_move,
+        "castling": castling,
+        "en_passant": en_passant,
+    }
+
+
+def positions_from_games(games):
+    """Batch dict (see positions_from_fens) for a list of Game objects."""
+    count = len(games)
+    castling = np.zeros((count, 4), dtype=bool)
+    for number, game in enumerate(games):
+        letters = game.castling_fen()
+        for column, letter in enumerate("KQkq"):
+            castling[number, column] = letter in letters
+    return {
+        "boards": boards_from_rows([game.board.squares for game in games]),
+        "white_to_move": np.array([game.turn == "white" for game in games], dtype=bool),
+        "castling": castling,
+        "en_passant": np.array([-1 if game.en_passant_index is None else game.en_passant_index
+                                for game in games], dtype=np.int8),
+    }
+# ------------------------
+
+
+def _oriented(boards, white):
+    # (N, 65) boards with `white` (bool per position) as the positive side moving up
+    boards = np.asarray(boards, dtype=np.int8)
+    white = np.broadcast_to(np.asarray(white, dtype=bool), (len(boards),))
+    oriented = np.empty((len(boards), 65), dtype=np.int8)
+    oriented[:, :64] = np.where(white[:, None], boards, -boards[:, _MIRROR])
+    oriented[:, 64] = OFF_BOARD
+    return oriented, white
+
+
+def _slider_hits(pieces):
+    # (M, 8) bool: pieces[i, ray] is a negative slider that attacks along that ray
+    return (pieces == _SLIDERS[:, 0]) | (pieces == _SLIDERS[:, 1])
+
+
+def _attacked_at(oriented, squares):
+    # (M,) bool: is squares[i] on oriented board i attacked by the negative side
+    # (looking outward from the square, like index_is_attacked)
+    flat = oriented.ravel()
+    base = (np.arange(len(oriented), dtype=np.int32) * 65)[:, None]
+    slides = flat[base[:, :, None] + SLIDES[squares]]
+    jumps = flat[base + JUMPS[squares]]
+    first = (slides != 0).argmax(axis=2)
+    blockers = np.take_along_axis(slides, first[..., None], axis=2)[..., 0]
+    nearest = slides[:, :, 0]
+    return (
+        _slider_hits(blockers).any(axis=1)
+        | (nearest == -KING).any(axis=1)
+        | (nearest[:, 0:2] == -PAWN).any(axis=1)  # enemy pawns capture downwards
+        | (jumps == -KNIGHT).any(axis=1)
+    )
+
+
+def _pinned(oriented, king_squares):
+    # (N, 65) bool: own pieces that are the only thing between their king and an enemy slider
+    count = len(oriented)
+    rays = SLIDES[king_squares]
+    slides = oriented.ravel()[(np.arange(count, dtype=np.int32) * 65)[:, None, None] + rays]
+    occupied = np.cumsum(slides != 0, axis=2)
+    first = (occupied == 1).argmax(axis=2)[..., None]
+    second = (occupied == 2).argmax(axis=2)[..., None]
+    shield = np.take_along_axis(slides, first, axis=2)[..., 0]
+    attacker = np.take_along_axis(slides, second, axis=2)[..., 0]
+    pins = (shield > 0) & (shield <= KING) & _slider_hits(attacker) & (occupied[..., -1] >= 2)
+    pinned = np.zeros((count, 65), dtype=bool)
+    positions, ray = np.nonzero(pins)
+    pinned[positions, rays[positions, ray, first[positions, ray, 0]]] = True
+    return pinned
+
+
+def _reached(oriented, piece_filter, include_own):
+    # (position, from, to) for every square the selected positive pieces reach along their rays;
+    # include_own: count the first own piece hit as reached (attack maps), else stop before it
+    flat = oriented.ravel()
+    positions, squares = np.nonzero(piece_filter)
+    types = oriented[positions, squares]
+    sliding = (types >= BISHOP) & (types <= QUEEN)
+    found = []
+    for chosen, table in ((~sliding, NEAR), (sliding, SLIDES)):
+        chosen_positions = positions[chosen]
+        chosen_squares = squares[chosen]
+        targets = table[chosen_squares]
+        reach = RAY_REACH[types[chosen], :targets.shape[1]]
+        if table is NEAR:
+            values = flat[(chosen_positions.astype(np.int32) * 65)[:, None] + targets]
+            reached = (reach > 0) & (targets != 64)
+        else:
+            values = flat[(chosen_positions.astype(np.int32) * 65)[:, None, None] + targets]
+            occupied = values != 0
+            clear_before = (np.cumsum(occupied, axis=2) - occupied) == 0
+            reached = clear_before & (_STEPS < reach[:, :, None]) & (targets != 64)
+        if not include_own:
+            reached &= values <= 0
+        counts = reached.reshape(len(targets), -1).sum(axis=1)
+        found.append((np.repeat(chosen_positions, counts), np.repeat(chosen_squares, counts), targets[reached]))
+    return tuple(np.concatenate(parts) for parts in zip(*found))
+
+
+def attacked_squares(boards, by_white):
+    """(N, 64) bool: squares attacked by white (by_white True) or black pieces, per position.
+
+    by_white is one bool or one per position. Like index_is_attacked, a square
+    counts as attacked whatever stands on it.
+    """
+    oriented, white = _oriented(boards, by_white)
+    pieces = oriented[:, :64]
+    positions, _, targets = _reached(oriented, (pieces > 0) & (pieces <= KING), include_own=True)
+    attacked = np.zeros((len(oriented), 65), dtype=bool)
+    attacked[positions, targets] = True
+    attacked = attacked[:, :64]
+    return np.where(white[:, None], attacked, attacked[:, _MIRROR])
+
+
+def in_check(boards, white_to_move):
+    """(N,) bool: is the side to move in check (king_in_check for the whole batch)."""
+    oriented, _ = _oriented(boards, white_to_move)
+    return _attacked_at(oriented, (oriented[:, :64] == KING).argmax(axis=1))
+
+
+def _pawn_moves(oriented, en_passant):
+    # (position, from, to, captured square or 64, promotion) for every pseudo-legal pawn move
+    pieces = oriented[:, :64]
+    positions, squares = np.nonzero(pieces == PAWN)
+    cols = squares & 7
+    found = []
+
+    one = squares - 8
+    pushes = pieces[positions, one] == 0
+    found.append((positions[pushes], squares[pushes], one[pushes], np.full(pushes.sum(), 64)))
+    doubles = pushes & (squares >> 3 == 6)
+    doubles[doubles] = pieces[positions[doubles], squares[doubles] - 16] == 0
+    found.append((positions[doubles], squares[doubles], squares[doubles] - 16, np.full(doubles.sum(), 64)))
+
+    for step, on_board in ((9, cols > 0), (7, cols < 7)):
+        to = squares - step
+        targets = np.where(on_board, pieces[positions, np.where(on_board, to, 0)], 0)
+        captures = on_board & (targets < 0)
+        found.append((positions[captures], squares[captures], to[captures], np.full(captures.sum(), 64)))
+        passant = on_board & (targets == 0) & (to == en_passant[positions])
+        found.append((positions[passant], squares[passant], to[passant], to[passant] + 8))
+
+    positions, froms, tos, captured = (np.concatenate(parts) for parts in zip(*found))
+    return positions, froms, tos, captured, tos >> 3 == 0
+
+
+def _castling_moves(oriented, castling):
+    # (N,) legal castling moves per position, castling_status for the whole batch;
+    # castling is (N, 2) rights of the side to move: kingside, queenside
+    pieces = oriented[:, :64]
+    count = len(oriented)
+    total = np.zeros(count, dtype=np.int32)
+    home = (pieces[:, 60] == KING) & castling.any(axis=1)
+    if not home.any():
+        return total
+    home &= ~_attacked_at(oriented, np.full(count, 60))
+    for side, rook, empty, passed in ((0, 63, (61, 62), (61, 62)), (1, 56, (57, 58, 59), (59, 58))):
+        able = home & castling[:, side] & (pieces[:, rook] == ROOK)
+        for square in empty:
+            able &= pieces[:, square] == 0
+        for square in passed:
+            able[able] &= ~_attacked_at(oriented[able], np.full(able.sum(), square))
+        total += able
+    return total
+
+
+def _legal_move_counts(boards, white_to_move, castling, en_passant):
+    oriented, white = _oriented(boards, white_to_move)
+    count = len(oriented)
+    en_passant = np.where(en_passant >= 0, np.where(white, en_passant, _MIRROR[en_passant]), -1)
+    own_castling = np.where(white[:, None], castling[:, 0:2], castling[:, 2:4])
+    king_squares = (oriented[:, :64] == KING).argmax(axis=1)
+    checked = _attacked_at(oriented, king_squares)
+
+    pieces = oriented[:, :64]
+    piece_positions, piece_froms, piece_tos = _reached(oriented, (pieces >= KNIGHT) & (pieces <= KING), False)
+    pawn_positions, pawn_froms, pawn_tos, captured, promotions = _pawn_moves(oriented, en_passant)
+    positions = np.concatenate((piece_positions, pawn_positions))
+    froms = np.concatenate((piece_froms, pawn_froms))
+    tos = np.concatenate((piece_tos, pawn_tos))
+    captured = np.concatenate((np.full(len(piece_positions), 64), captured))
+    # every promotion piece is a separate move, as in perft
+    weights = np.concatenate((np.ones(len(piece_positions), dtype=np.int32), np.where(promotions, 4, 1)))
+
+    # out of check, only king moves, en passant and moves of pinned pieces can expose the king
+    kings = king_squares[positions]
+    pinned = _pinned(oriented, king_squares)
+    doubtful = checked[positions] | (froms == kings) | (captured != 64) | pinned[positions, froms]
+    # play those on a copy of their position and keep the ones that leave the king safe
+    rows = np.nonzero(doubtful)[0]
+    after = oriented[positions[rows]]
+    moved = np.arange(len(rows))
+    after[moved, tos[rows]] = after[moved, froms[rows]]
+    after[moved, froms[rows]] = 0
+    after[moved, captured[rows]] = np.where(captured[rows] == 64, OFF_BOARD, 0)  # 64 (padding) unless en passant
+    safe = np.ones(len(positions), dtype=bool)
+    safe[rows] = ~_attacked_at(after, np.where(froms[rows] == kings[rows], tos[rows], kings[rows]))
+
+    counts = np.bincount(positions[safe], weights=weights[safe], minlength=count).astype(np.int32)
+    return counts + _castling_moves(oriented, own_castling)
+
+
+def legal_move_counts(boards, white_to_move, castling=None, en_passant=None, chunk_size=CHUNK_SIZE):
+    """(N,) int32 number of legal moves for the side to move, counting each promotion piece.
+
+    castling is (N, 4) bool in K, Q, k, q order (default: none), en_passant
+    (N,) square indexes or -1 (default: none). Positions are processed
+    chunk_size at a time so the per-move temporaries stay bounded.
+    """
+    boards = np.asarray(boards, dtype=np.int8)
+    count = len(boards)
+    white_to_move = np.broadcast_to(np.asarray(white_to_move, dtype=bool), (count,))
+    castling = np.zeros((count, 4), dtype=bool) if castling is None else np.asarray(castling, dtype=bool)
+    en_passant = np.full(count, -1) if en_passant is None else np.asarray(en_passant).astype(np.int32)
+    counts = np.zeros(count, dtype=np.int32)
+    for start in range(0, count, chunk_size):
+        end = start + chunk_size
+        counts[start:end] = _legal_move_counts(boards[start:end], white_to_move[start:end],
+                                               castling[start:end], en_passant[start:end])
+    return counts
+
+
+def screen(batch):
+    """in_check, legal_moves, checkmate and stalemate arrays for a batch dict, plus
+    "attacked": the squares the side not to move attacks."""
+    boards = batch["boards"]
+    white_to_move = batch["white_to_move"]
+    check = in_check(boards, white_to_move)
+    moves = legal_move_counts(boards, white_to_move, batch.get("castling"), batch.get("en_passant"))
+    return {
+        "in_check": check,
+        "legal_moves": moves,
+        "checkmate": check & (moves == 0),
+        "stalemate": ~check & (moves == 0),
+        "attacked": attacked_squares(boards, ~white_to_move),
+    }
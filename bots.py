@@ -0,0 +1,330 @@
+# bots.py
+#
+# Engine opponents for server rooms. Searches run in a ProcessPoolExecutor
+# shared by every bot room; BotScheduler feeds it one job at a time per free
+# worker, taking rooms in round-robin order, so a room with a long time budget
+# can't hold the pool ahead of the others.
+
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from engine import MOVE_DOUBLE_PUSH, Game
+from search import Searcher
+
+DEFAULT_BOT_TIME = 1.0  # seconds per move
+MIN_BOT_TIME = 0.1
+MAX_BOT_TIME = 10.0
+MAX_PONDER_TIME = 60.0  # a ponder search nobody answers gives its worker back after this
+BOT_TT_BITS = 16
+CALLBACK_WORKERS = 2  # threads running on_done callbacks (they wait for room locks)
+
+
+class BotPlayer:
+    """Stands in a Room.players slot like a ClientSession; its moves come from BotScheduler."""
+
+    def __init__(self, time_limit=DEFAULT_BOT_TIME, ponder=False):
+        self.time_limit = min(max(float(time_limit), MIN_BOT_TIME), MAX_BOT_TIME)
+        self.username = f"Bot ({self.time_limit:g}s)"
+        self.room = None
+        self.generation = 0  # bumped to invalidate searches for an earlier position / game
+
+        # pondering: search our reply to the predicted move while the opponent thinks
+        self.ponder = ponder
+        self.ponder_move = None  # predicted opponent move (uci) being pondered on
+        self.ponder_since = 0.0  # time.time() the ponder search was queued
+        self.ponder_result = None  # finished ponder search, waiting for the opponent's move
+        self.ponder_hit = False  # the prediction came true; the ponder search is now the real one
+        self.turn_started = None  # perf_counter() when the bot's turn started, for reply latency
+
+    def send(self, data):
+        pass
+
+    def send_frame(self, kind, frame):
+        pass
+
+    def close(self):
+        pass
+
+
+def search_job_for(game, time_limit, ponder_move=None):
+    # everything a worker process needs to rebuild the position;
+    # a ponder job plays ponder_move (packed) first and searches until stopped
+    return {
+        "board": ["".join(row) for row in game.board.grid],
+        "moved_mask": game.board.moved_mask,
+        "turn": game.turn,
+        "en_passant_index": game.en_passant_index,
+        "seen_keys": list(game.position_counts),
+        "time_limit": time_limit,
+        "ponder_move": ponder_move,
+        "pondered": False,  # set once the prediction came true
+    }
+
+
+def _is_ponder(job):
+    return job["ponder_move"] is not None and not job["pondered"]
+
+
+# --- worker process state ---
+_worker_searcher = None
+_stop_flags = None  # shared with the scheduler: one stop flag per job slot
+_deadlines = None  # one time.time() deadline per job slot, 0.0 = none
+
+
+def _init_worker(stop_flags, deadlines):
+    global _stop_flags, _deadlines
+    _stop_flags = stop_flags
+    _deadlines = deadlines
+
+
+def run_search_job(job):
+    """Runs in a pool process. The process keeps one Searcher, so its
+    transposition table carries over between the moves it is asked for."""
+    global _worker_searcher
+    if _worker_searcher is None:
+        _worker_searcher = Searcher(BOT_TT_BITS)
+
+    game = Game()
+    game.board.load_rows(job["board"])
+    game.board.moved_mask = job["moved_mask"]
+    game.turn = job["turn"]
+    game.en_passant_index = job["en_passant_index"]
+    game.position_counts = Counter(job["seen_keys"])
+
+    move = job["ponder_move"]
+    if move is not None:
+        game.board.apply_move(move)
+        if (move >> 12) & 7 == MOVE_DOUBLE_PUSH:
+            game.en_passant_index = ((move & 63) + ((move >> 6) & 63)) // 2
+        else:
+            game.en_passant_index = None
+        game.turn = "black" if game.turn == "white" else "white"
+        game.position_counts[game.position_key()] += 1
+
+    slot = job["slot"]
+
+    def stop_check():
+        deadline = _deadlines[slot]
+        return _stop_flags[slot] != 0 or (deadline > 0.0 and time.time() >= deadline)
+
+    if job.get("lines"):
+        return _worker_searcher.analyze(game, job["lines"], job["max_depth"], job["time_limit"], stop_check)
+    time_limit = None if _is_ponder(job) else job["time_limit"]
+    return _worker_searcher.search(game, time_limit=time_limit, stop_check=stop_check)
+# ----------------------------
+
+
+def _run_callback(on_done, result, error):
+    try:
+        on_done(result, error)
+    except Exception:
+        traceback.print_exc()  # a future would keep it to itself
+
+
+class BotScheduler:
+    """Round-robin dispatcher from bot rooms to a bounded process pool.
+
+    Each room has at most one queued search (a newer request replaces it);
+    at most `workers` searches run at once, each in its own slot of shared
+    stop flags, so cancel() stops a running search within milliseconds.
+    Ponder jobs only get workers that no move search is waiting for, and
+    give them back as soon as one is. Jobs submitted before start() wait.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.executor = None
+        self.callbacks = ThreadPoolExecutor(CALLBACK_WORKERS, thread_name_prefix="bot-callback")
+        self.closed = False
+        self.stop_flags = multiprocessing.RawArray("b", self.workers)
+        self.deadlines = multiprocessing.RawArray("d", self.workers)
+        self.free_slots = list(range(self.workers))
+        self.lock = threading.RLock()  # RLock: a done callback can run inside submit()
+        self.pending = OrderedDict()  # room_id -> (job, on_done, queued_at), oldest first
+        self.running = {}  # room_id -> (future, slot, job)
+        self.cancelled = set()  # running room ids whose result must be dropped
+        self.metrics = Counter()  # submitted / started / completed / cancelled / failed / ponder_*
+        self.max_queue_depth = 0
+        self.total_wait = 0.0
+
+    def start(self):
+        """Create the process pool; call once at server start, before any client thread.
+
+        Workers come from a forkserver (spawn where there is none), never from a
+        fork of the server, whose other threads may hold locks at that moment.
+        """
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        if context.get_start_method() == "forkserver":
+            context.set_forkserver_preload(["bots"])  # workers start with the engine imported
+        with self.lock:
+            if self.executor is not None or self.closed:
+                return
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=context,
+                initializer=_init_worker, initargs=(self.stop_flags, self.deadlines),
+            )
+            self._dispatch()
+
+    def submit(self, room_id, job, on_done):
+        # on_done(result, error) is called exactly once, on its own thread: with the
+        # search result and None, or with None and why there is none (failed,
+        # cancelled, replaced by a newer job for the room, scheduler shut down)
+        with self.lock:
+            if self.closed:
+                self._notify(on_done, None, "scheduler shut down")
+                return
+            replaced = self.pending.pop(room_id, None)
+            if replaced is not None:
+                self._notify(replaced[1], None, "replaced")
+            self.pending[room_id] = (job, on_done, time.perf_counter())
+            self.metrics["submitted"] += 1
+            if _is_ponder(job):
+                self.metrics["ponder_started"] += 1
+            self.max_queue_depth = max(self.max_queue_depth, len(self.pending))
+            self._dispatch()
+
+    def cancel(self, room_id):
+        with self.lock:
+            pending = self.pending.pop(room_id, None)
+            if pending is not None:
+                self.metrics["cancelled"] += 1
+                self._notify(pending[1], None, "cancelled")
+            running = self.running.get(room_id)
+            if running is not None and room_id not in self.cancelled:
+                self.cancelled.add(room_id)
+                self.stop_flags[running[1]] = 1
+                self.metrics["cancelled"] += 1
+
+    def ponder_hit(self, room_id, time_limit, pondering_since):
+        """The predicted move was played: the room's ponder search becomes its move
+        search and ends time_limit seconds after pondering started (at once if that
+        has passed). Returns False if the room has no ponder search to reuse."""
+        with self.lock:
+            pending = self.pending.get(room_id)
+            if pending is not None and _is_ponder(pending[0]):
+                job, on_done, queued_at = pending
+                self.pending[room_id] = (dict(job, time_limit=time_limit, pondered=True), on_done, queued_at)
+                self._dispatch()
+                return True
+            running = self.running.get(room_id)
+            if running is None or room_id in self.cancelled or not _is_ponder(running[2]):
+                return False
+            self.deadlines[running[1]] = max(time.time(), pondering_since + time_limit)
+            running[2]["pondered"] = True
+            return True
+
+    def _start(self, room_id):
+        job, on_done, queued_at = self.pending.pop(room_id)
+        slot = self.free_slots.pop()
+        job = dict(job, slot=slot)
+        self.stop_flags[slot] = 0
+        self.deadlines[slot] = time.time() + MAX_PONDER_TIME if _is_ponder(job) else 0.0
+        self.total_wait += time.perf_counter() - queued_at
+        self.metrics["started"] += 1
+        future = self.executor.submit(run_search_job, job)
+        self.running[room_id] = (future, slot, job)
+        future.add_done_callback(lambda done: self._finished(room_id, done, on_done))
+
+    def _dispatch(self):
+        # caller holds self.lock
+        if self.executor is None:
+            return  # not started yet, or shut down
+        # move searches first, oldest first, then ponder jobs on whatever is left
+        for pondering in (False, True):
+            for room_id in list(self.pending):
+                if len(self.running) >= self.workers:
+                    break
+                if _is_ponder(self.pending[room_id][0]) == pondering and room_id not in self.running:
+                    self._start(room_id)
+
+        # move searches still waiting: take workers back from pondering rooms
+        waiting = sum(
+            1 for room_id, (job, _, _) in self.pending.items()
+            if not _is_ponder(job) and room_id not in self.running
+        ) - len(self.cancelled)  # cancelled searches are already giving their workers back
+        for room_id, (_, slot, job) in self.running.items():
+            if waiting <= 0:
+                break
+            if _is_ponder(job) and room_id not in self.cancelled:
+                self.cancelled.add(room_id)
+                self.stop_flags[slot] = 1
+                self.metrics["ponder_preempted"] += 1
+                waiting -= 1
+
+    def _finished(self, room_id, future, on_done):
+        result, error = None, "cancelled"
+        try:
+            with self.lock:
+                _, slot, _ = self.running.pop(room_id)
+                self.free_slots.append(slot)
+                dropped = room_id in self.cancelled
+                self.cancelled.discard(room_id)
+                self._dispatch()
+
+            if not dropped and not future.cancelled():
+                try:
+                    result, error = future.result(), None
+                except Exception as e:
+                    error = f"search failed: {e}"
+                    with self.lock:
+                        self.metrics["failed"] += 1
+                    print(f"Bot search failed for room {room_id}: {e}")
+                else:
+                    with self.lock:
+                        self.metrics["completed"] += 1
+        finally:
+            self._notify(on_done, result, error)
+
+    def _notify(self, on_done, result, error):
+        # the pool's callback thread serves every room, and cancel() runs under the
+        # caller's room lock, so on_done always runs on the callback threads
+        try:
+            self.callbacks.submit(_run_callback, on_done, result, error)
+        except RuntimeError:
+            _run_callback(on_done, result, error)  # interpreter exiting: its pools are shut down
+
+    def record_ponder(self, hit):
+        with self.lock:
+            self.metrics["ponder_hits" if hit else "ponder_misses"] += 1
+
+    def record_reply(self, seconds, pondered):
+        # time from the opponent's move to the bot's reply
+        kind = "pondered" if pondered else "searched"
+        with self.lock:
+            self.metrics[f"{kind}_replies"] += 1
+            self.metrics[f"{kind}_reply_seconds"] += seconds
+
+    def stats(self):
+        with self.lock:
+            metrics = self.metrics
+            started = metrics["started"]
+            predictions = metrics["ponder_hits"] + metrics["ponder_misses"]
+            stats = {
+                "workers": self.workers,
+                "queue_depth": len(self.pending),
+                "running": len(self.running),
+                "max_queue_depth": self.max_queue_depth,
+                "average_wait": self.total_wait / started if started else 0.0,
+                "ponder_hit_rate": metrics["ponder_hits"] / predictions if predictions else 0.0,
+            }
+            for kind in ("pondered", "searched"):
+                replies = metrics[f"{kind}_replies"]
+                stats[f"average_{kind}_reply"] = metrics[f"{kind}_reply_seconds"] / replies if replies else 0.0
+            stats.update(metrics)
+            return stats
+
+    def shutdown(self):
+        with self.lock:
+            self.closed = True
+            executor, self.executor = self.executor, None
+            for _, on_done, _ in self.pending.values():
+                self._notify(on_done, None, "scheduler shut down")
+            self.pending.clear()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
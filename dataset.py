@@ -0,0 +1,203 @@
+# dataset.py
+#
+# Training-data export: replays recorded games through Game and writes every
+# position as a 12x8x8 bit-plane tensor (one plane per piece in PLANE_PIECES
+# order, row 0 = rank 8 as in engine.py) with side-to-move, castling and
+# result labels.
+#
+# Output is a directory of fixed-size chunks, each a pair of .npy files that
+# np.load(..., mmap_mode="r") maps without copying, plus index.json:
+#
+#   planes-00000.npy   uint8 (count, 12, 8, 8)
+#   labels-00000.npy   LABEL_DTYPE (count,)
+#   index.json         chunk list, position / game totals, the encoding
+#
+# Only one chunk is in memory while exporting, so the input can be any size.
+#
+#   python dataset.py games.jsonl out_dir [--chunk-size 65536] [--strict]
+#
+# Input is JSON lines, one game each: {"moves": ["e2e4", ...] (UCI or SAN),
+# "result": "1-0", "fen": optional start position}. Games without a result ("*") or with a move
+# that fails Game.replay's checks (--strict: any illegal move) are skipped.
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from batch import PIECE_CODES, boards_from_rows
+from engine import Game
+
+PLANE_PIECES = "PNBRQKpnbrqk"
+PLANE_CODES = np.array([PIECE_CODES[piece] for piece in PLANE_PIECES], dtype=np.int8)
+CHUNK_SIZE = 65536  # positions per chunk file: 48 MiB of planes
+RESULTS = {"1-0": 1, "0-1": -1, "1/2-1/2": 0}  # result label, from white's point of view
+CASTLING_BITS = {"K": 1, "Q": 2, "k": 4, "q": 8}
+LABEL_DTYPE = np.dtype([
+    ("white_to_move", "u1"),
+    ("castling", "u1"),  # CASTLING_BITS of the rights still available
+    ("result", "i1"),  # RESULTS value of the game the position comes from
+    ("game", "<u4"),  # game number in export order
+    ("ply", "<u2"),  # half-moves played to reach the position
+])
+
+
+def bit_planes(boards):
+    """(N, 12, 8, 8) uint8 planes from (N, 64) int8 batch boards (see batch.py)."""
+    boards = np.asarray(boards, dtype=np.int8)
+    return (boards[:, None, :] == PLANE_CODES[None, :, None]).view(np.uint8).reshape(-1, 12, 8, 8)
+
+
+def replay_positions(record, strict=False):
+    """(squares, white_to_move, castling) for every position of a game record, start and
+    final position included. Raises ValueError for a bad start position or move
+    (strict: any illegal move, otherwise Game.replay's sanity checks)."""
+    game = Game.from_fen(record["fen"]) if record.get("fen") else Game()
+    positions = [_position_labels(game)]
+    for _ in game.iter_replay(record["moves"], strict):
+        positions.append(_position_labels(game))
+    return positions
+
+
+def _position_labels(game):
+    castling = 0
+    for letter in game.castling_fen():
+        castling |= CASTLING_BITS.get(letter, 0)
+    return "".join(game.board.squares), game.turn == "white", castling
+
+
+class ChunkWriter:
+    """Appends labelled positions to chunk files in a directory; call close() to write index.json."""
+
+    def __init__(self, directory, chunk_size=CHUNK_SIZE):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.chunks = []  # {"planes", "labels", "count"} per finished chunk
+        self.positions = 0
+        self.games = 0
+        self.pending_rows = []  # squares strings of the chunk being filled
+        self.pending_labels = np.zeros(chunk_size, dtype=LABEL_DTYPE)
+        os.makedirs(directory, exist_ok=True)
+
+    def add_game(self, positions, result):
+        for number, (squares, white_to_move, castling) in enumerate(positions):
+            self.pending_labels[len(self.pending_rows)] = (white_to_move, castling, result, self.games, number)
+            self.pending_rows.append(squares)
+            if len(self.pending_rows) == self.chunk_size:
+                self._flush()
+        self.games += 1
+
+    def _flush(self):
+        count = len(self.pending_rows)
+        if not count:
+            return
+        name = f"{len(self.chunks):05d}"
+        planes = np.lib.format.open_memmap(os.path.join(self.directory, f"planes-{name}.npy"),
+                                           mode="w+", dtype=np.uint8, shape=(count, 12, 8, 8))
+        planes[:] = bit_planes(boards_from_rows(self.pending_rows))
+        planes.flush()
+        del planes
+        np.save(os.path.join(self.directory, f"labels-{name}.npy"), self.pending_labels[:count])
+        self.chunks.append({"planes": f"planes-{name}.npy", "labels": f"labels-{name}.npy", "count": count})
+        self.positions += count
+        self.pending_rows = []
+
+    def close(self):
+        self._flush()
+        index = {
+            "positions": self.positions,
+            "games": self.games,
+            "chunk_size": self.chunk_size,
+            "plane_pieces": PLANE_PIECES,
+            "castling_bits": CASTLING_BITS,
+            "results": RESULTS,
+            "chunks": self.chunks,
+        }
+        with open(os.path.join(self.directory, "index.json"), "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=1)
+        return index
+
+
+def export_games(records, directory, chunk_size=CHUNK_SIZE, strict=False):
+    """Write the positions of every usable game record to directory.
+
+    Returns the index dict, with "skipped" counts of games left out.
+    """
+    writer = ChunkWriter(directory, chunk_size)
+    skipped = {"no_result": 0, "illegal": 0}
+    for record in records:
+        result = RESULTS.get(record.get("result"))
+        if result is None:
+            skipped["no_result"] += 1
+            continue
+        try:
+            positions = replay_positions(record, strict)
+        except ValueError:
+            skipped["illegal"] += 1
+            continue
+        writer.add_game(positions, result)
+    index = writer.close()
+    index["skipped"] = skipped
+    return index
+
+
+def read_records(path):
+    # one game record per non-empty line, read lazily
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class PositionDataset:
+    """Read-only view of an exported directory: chunks are memory-mapped, nothing is copied.
+
+    dataset[i] is (planes, labels) of the i-th position; dataset.chunk(n) the
+    whole n-th chunk as a pair of memory-mapped arrays.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "index.json"), encoding="utf-8") as f:
+            self.index = json.load(f)
+        self.planes = [np.load(os.path.join(directory, chunk["planes"]), mmap_mode="r")
+                       for chunk in self.index["chunks"]]
+        self.labels = [np.load(os.path.join(directory, chunk["labels"]), mmap_mode="r")
+                       for chunk in self.index["chunks"]]
+        self.starts = np.cumsum([0] + [chunk["count"] for chunk in self.index["chunks"]])
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def __getitem__(self, position):
+        if not 0 <= position < len(self):
+            raise IndexError(position)
+        number = int(np.searchsorted(self.starts, position, side="right")) - 1
+        offset = position - self.starts[number]
+        return self.planes[number][offset], self.labels[number][offset]
+
+    def chunk(self, number):
+        return self.planes[number], self.labels[number]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export recorded games as bit-plane training data.")
+    parser.add_argument("games", help="JSON lines file of game records")
+    parser.add_argument("directory", help="output directory for the chunks and index.json")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="positions per chunk file")
+    parser.add_argument("--strict", action="store_true", help="check every move against the legal moves")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    index = export_games(read_records(args.games), args.directory, args.chunk_size, args.strict)
+    elapsed = time.perf_counter() - started
+    rate = index["positions"] / elapsed if elapsed > 0 else 0.0
+    print(f"{index['positions']} positions from {index['games']} games in {len(index['chunks'])} chunk(s), "
+          f"{elapsed:.1f}s ({rate:,.0f} positions/s); skipped {index['skipped']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
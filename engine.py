@@ -1,50 +1,322 @@
 # engine.py
 
+import random
+import re
+import struct
+import threading
+from collections import Counter, OrderedDict
+
+
 def is_white_piece(ch):
     return ch != "." and ch.isupper()
 
 def is_black_piece(ch):
     return ch != "." and ch.islower()
 
-def sign(x):
-    if x > 0:
-        return 1
-    if x < 0:
-        return -1
-    return 0
+
+KNIGHT_OFFSETS = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
+KING_OFFSETS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+ROOK_DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+PIECE_NAMES = {"p": "pawn", "n": "knight", "b": "bishop", "r": "rook", "q": "queen", "k": "king"}
+
+
+# --- squares and moves as integers ---
+# square index = row * 8 + col, the same layout as Board.grid: 0 = a8, 7 = h8, 56 = a1, 63 = h1.
+# Square names ("e4") are only used at the boundaries (Game.try_move, the server protocol, the client).
+SQUARE_NAMES = [chr(ord("a") + col) + str(8 - row) for row in range(8) for col in range(8)]
+SQUARE_INDEX = {name: index for index, name in enumerate(SQUARE_NAMES)}
+
+# packed move: from (bits 0-5) | to (6-11) | flag (12-14) | promotion piece (15-17)
+MOVE_NORMAL = 0
+MOVE_DOUBLE_PUSH = 1
+MOVE_EN_PASSANT = 2
+MOVE_CASTLING = 3
+MOVE_PROMOTION = 4
+PROMOTION_LETTERS = ".qrbn"  # promotion field -> piece letter (0 = not chosen yet)
+
+
+def encode_move(from_index, to_index, flag=MOVE_NORMAL, promotion=0):
+    return from_index | (to_index << 6) | (flag << 12) | (promotion << 15)
+
+
+def move_promotion(move):
+    # "q" / "r" / "b" / "n", or None when no promotion piece is encoded
+    code = move >> 15
+    return PROMOTION_LETTERS[code] if code else None
+
+
+def with_promotion(move, piece_letter):
+    return (move & 0x7FFF) | (PROMOTION_LETTERS.index(piece_letter.lower()) << 15)
+
+
+def move_to_uci(move):
+    return SQUARE_NAMES[move & 63] + SQUARE_NAMES[(move >> 6) & 63] + (move_promotion(move) or "")
+# --------------------------------------
+
+
+def _build_offset_table(offsets):
+    # square index -> list of on-board square indexes
+    table = []
+    for row in range(8):
+        for col in range(8):
+            table.append([
+                (row + delta_row) * 8 + col + delta_col
+                for delta_row, delta_col in offsets
+                if 0 <= row + delta_row < 8 and 0 <= col + delta_col < 8
+            ])
+    return table
+
+
+def _build_ray_table(directions):
+    # square index -> one list of square indexes per direction, nearest square first
+    table = []
+    for row in range(8):
+        for col in range(8):
+            rays = []
+            for delta_row, delta_col in directions:
+                ray = []
+                r, c = row + delta_row, col + delta_col
+                while 0 <= r < 8 and 0 <= c < 8:
+                    ray.append(r * 8 + c)
+                    r += delta_row
+                    c += delta_col
+                if ray:
+                    rays.append(ray)
+            table.append(rays)
+    return table
+
+
+KNIGHT_TARGETS = _build_offset_table(KNIGHT_OFFSETS)
+KING_TARGETS = _build_offset_table(KING_OFFSETS)
+DIAGONAL_RAYS = _build_ray_table(BISHOP_DIRECTIONS)
+STRAIGHT_RAYS = _build_ray_table(ROOK_DIRECTIONS)
+QUEEN_RAYS = [DIAGONAL_RAYS[index] + STRAIGHT_RAYS[index] for index in range(64)]
+# squares a pawn of that colour on the index attacks (white pawns move towards row 0)
+PAWN_CAPTURES = {
+    "white": _build_offset_table([(-1, -1), (-1, 1)]),
+    "black": _build_offset_table([(1, -1), (1, 1)]),
+}
+# castling king destination -> (rook from, rook to)
+CASTLING_ROOK_SQUARES = {62: (63, 61), 58: (56, 59), 6: (7, 5), 2: (0, 3)}
+
+
+# --- evaluation terms (Board keeps running totals of both) ---
+PIECE_VALUES = {"p": 100, "n": 320, "b": 330, "r": 500, "q": 900, "k": 0}
+
+# piece-square tables from white's side, laid out like Board.grid (first row = rank 8);
+# black pieces read them at index ^ 56 (PIECE_SQUARE_SCORES has both colours)
+PIECE_SQUARE_TABLES = {
+    "p": [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0,
+    ],
+    "n": [
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50,
+    ],
+    "b": [
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20,
+    ],
+    "r": [
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0,
+    ],
+    "q": [
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20,
+    ],
+    "k": [
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        20, 30, 10, 0, 0, 10, 30, 20,
+    ],
+}
+PIECE_SQUARE_SCORES = {
+    piece: (
+        list(PIECE_SQUARE_TABLES[piece.lower()]) if piece.isupper()
+        else [PIECE_SQUARE_TABLES[piece][index ^ 56] for index in range(64)]
+    )
+    for piece in "PNBRQKpnbrqk"
+}
+# --------------------------------------
+
+
+# --- Zobrist keys ---
+# fixed seed: keys must agree between processes (worker pools, caches)
+_zobrist_random = random.Random(20240601)
+ZOBRIST_PIECES = {piece: [_zobrist_random.getrandbits(64) for _ in range(64)] for piece in "PNBRQKpnbrqk"}
+ZOBRIST_CASTLING = {
+    flag: _zobrist_random.getrandbits(64)
+    for flag in ("white_king", "white_rook_a", "white_rook_h", "black_king", "black_rook_a", "black_rook_h")
+}
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+ZOBRIST_EN_PASSANT = [_zobrist_random.getrandbits(64) for _ in range(8)]  # by file
+# --------------------
+
+# --- castling rights: one "has moved" bit per king / corner rook ---
+MOVED_BITS = {
+    "white_king": 1,
+    "white_rook_a": 2,
+    "white_rook_h": 4,
+    "black_king": 8,
+    "black_rook_a": 16,
+    "black_rook_h": 32,
+}
+
+
+def moved_mask_from_flags(moved):
+    mask = 0
+    for flag, flag_bit in MOVED_BITS.items():
+        if moved.get(flag):
+            mask |= flag_bit
+    return mask
+
+
+def moved_flags_from_mask(mask):
+    return {flag: bool(mask & flag_bit) for flag, flag_bit in MOVED_BITS.items()}
+
+# -------------------------------------------------------------------
+
+
+class UndoRecord:
+    # everything Board.undo_move needs; castling rights are saved as the moved mask (an int)
+    __slots__ = ("move", "captured", "capture_index", "moved_before")
+
+    def __init__(self):
+        self.move = 0
+        self.captured = "."
+        self.capture_index = 0  # the destination, or the passed pawn's square for en passant
+        self.moved_before = 0
+
+    @property
+    def en_passant(self):
+        return (self.move >> 12) & 7 == MOVE_EN_PASSANT
+
+
+class UndoStack:
+    """Preallocated UndoRecords for search/legality loops.
+
+    board.make_move(..., undo=stack.push()) fills a reused record instead of
+    allocating one; board.undo_move(stack.pop()) takes it back.
+    """
+
+    def __init__(self, size=128):
+        self.records = [UndoRecord() for _ in range(size)]
+        self.depth = 0
+
+    def push(self):
+        if self.depth == len(self.records):
+            self.records.append(UndoRecord())
+        record = self.records[self.depth]
+        self.depth += 1
+        return record
+
+    def pop(self):
+        self.depth -= 1
+        return self.records[self.depth]
 
 
 class Board:
+    debug_scores = False  # set True to re-check material/positional against a full recount after every move
+
     def __init__(self):
         self.grid = [["." for _ in range(8)] for _ in range(8)]
-        self.moved = {
-            "white_king": False,
-            "white_rook_a": False,
-            "white_rook_h": False,
-            "black_king": False,
-            "black_rook_a": False,
-            "black_rook_h": False,
-        }
+        self.squares = ["."] * 64  # flat copy of grid by square index, for the move generator
+        self.moved_mask = 0  # MOVED_BITS; `moved` is the dict view of it
+        # kept in sync by _put_piece (every board write goes through it)
+        self.king_squares = {"white": None, "black": None}
+        self.piece_squares = {"white": set(), "black": set()}
+        self.piece_key = 0  # Zobrist key of the pieces only, see position_key_for
+        self.material = {"white": 0, "black": 0}  # PIECE_VALUES per colour
+        self.positional = {"white": 0, "black": 0}  # PIECE_SQUARE_SCORES per colour
+        self.undo_stack = UndoStack()
 
     def reset(self):
-        self.grid = [["." for _ in range(8)] for _ in range(8)]
-        self.moved = {
-            "white_king": False,
-            "white_rook_a": False,
-            "white_rook_h": False,
-            "black_king": False,
-            "black_rook_a": False,
-            "black_rook_h": False,
-        }
+        self.moved_mask = 0
         self.setup_start_position()
 
+    @property
+    def moved(self):
+        return moved_flags_from_mask(self.moved_mask)
+
+    @moved.setter
+    def moved(self, flags):
+        self.moved_mask = moved_mask_from_flags(flags)
+
     def setup_start_position(self):
-        self.grid[0] = list("rnbqkbnr")
-        self.grid[1] = ["p"] * 8
-        for row in range(2, 6):
-            self.grid[row] = ["."] * 8
-        self.grid[6] = ["P"] * 8
-        self.grid[7] = list("RNBQKBNR")
+        self.load_rows([
+            "rnbqkbnr",
+            "pppppppp",
+            "........",
+            "........",
+            "........",
+            "........",
+            "PPPPPPPP",
+            "RNBQKBNR",
+        ])
+
+    def load_rows(self, rows):
+        # replace the whole position (e.g. from a server snapshot) and rebuild the piece lists
+        # (the same bookkeeping as _track_piece, inlined: this runs for every imported position)
+        self.grid = [list(row) for row in rows]
+        self.squares = squares = [piece for row in self.grid for piece in row]
+        self.king_squares = {"white": None, "black": None}
+        white = set()
+        black = set()
+        key = 0
+        material = {"white": 0, "black": 0}
+        positional = {"white": 0, "black": 0}
+        for index, piece in enumerate(squares):
+            if piece == ".":
+                continue
+            color = "white" if piece < "a" else "black"
+            (white if piece < "a" else black).add(index)
+            key ^= ZOBRIST_PIECES[piece][index]
+            material[color] += PIECE_VALUES[piece.lower()]
+            positional[color] += PIECE_SQUARE_SCORES[piece][index]
+            if piece == "K" or piece == "k":
+                self.king_squares[color] = index
+        self.piece_squares = {"white": white, "black": black}
+        self.piece_key = key
+        self.material = material
+        self.positional = positional
 
     def is_valid_square(self, square):
         return len(square) == 2 and ("a" <= square[0] <= "h") and ("1" <= square[1] <= "8")
@@ -58,364 +330,617 @@ class Board:
         return chr(ord("a") + col) + str(8 - row)
 
     def get_piece(self, square):
-        row, col = self.square_to_index(square)
-        return self.grid[row][col]
+        return self.squares[SQUARE_INDEX[square]]
+
+    def piece_at(self, index):
+        return self.squares[index]
+
+    def _track_piece(self, index, piece_char):
+        color = "white" if piece_char.isupper() else "black"
+        self.piece_squares[color].add(index)
+        self.piece_key ^= ZOBRIST_PIECES[piece_char][index]
+        self.material[color] += PIECE_VALUES[piece_char.lower()]
+        self.positional[color] += PIECE_SQUARE_SCORES[piece_char][index]
+        if piece_char in ("K", "k"):
+            self.king_squares[color] = index
+
+    def _put_piece(self, index, piece_char):
+        old = self.squares[index]
+        if old != ".":
+            color = "white" if old.isupper() else "black"
+            self.piece_squares[color].discard(index)
+            self.piece_key ^= ZOBRIST_PIECES[old][index]
+            self.material[color] -= PIECE_VALUES[old.lower()]
+            self.positional[color] -= PIECE_SQUARE_SCORES[old][index]
+            if old in ("K", "k") and self.king_squares[color] == index:
+                self.king_squares[color] = None
+        self.squares[index] = piece_char
+        self.grid[index >> 3][index & 7] = piece_char
+        if piece_char != ".":
+            self._track_piece(index, piece_char)
 
     def _set_raw(self, square, piece_char):
-        row, col = self.square_to_index(square)
-        self.grid[row][col] = piece_char
-
-    def _move_raw(self, from_square, to_square):
-        piece = self.get_piece(from_square)
-        self._set_raw(from_square, ".")
-        self._set_raw(to_square, piece)
-
-    def make_move(self, from_square, to_square, en_passant_target=None, turn=None):
-        undo = {
-            "from": from_square,
-            "to": to_square,
-            "captured": self.get_piece(to_square),
-            "castling": False,
-            "rook_from": None,
-            "rook_to": None,
-            "moved_before": self.moved.copy(),
-            "en_passant": False,
-            "ep_captured_square": None,
-            "ep_captured_piece": None,
-        }
-
-        moving_piece = self.get_piece(from_square)
-        from_row, from_col = self.square_to_index(from_square)
-        to_row, to_col = self.square_to_index(to_square)
-
-        # --- En Passant special move ---
-        if (
-                moving_piece.lower() == "p"
-                and en_passant_target is not None
-                and turn is not None
-        ):
-            # If pawn moves diagonally into EMPTY square that equals en_passant_target
-            if self.get_piece(to_square) == ".":
-                direction = -1 if turn == "white" else 1
-                if (to_row - from_row) == direction and abs(to_col - from_col) == 1 and to_square == en_passant_target:
-                    # captured pawn is behind the target square
-                    captured_row = to_row - direction
-                    captured_col = to_col
-                    captured_square = self.index_to_square(captured_row, captured_col)
-
-                    undo["en_passant"] = True
-                    undo["ep_captured_square"] = captured_square
-                    undo["ep_captured_piece"] = self.get_piece(captured_square)
-
-                    # move pawn
-                    self._move_raw(from_square, to_square)
-                    self._update_moved_flags(from_square, moving_piece)
-
-                    # remove captured pawn
-                    self._set_raw(captured_square, ".")
-                    return undo
-        # ------------------------------
+        self._put_piece(SQUARE_INDEX[square], piece_char)
+
+    def make_move(self, from_square, to_square, en_passant_target=None, turn=None, undo=None):
+        # string wrapper around apply_move: works out which special move this is
+        from_index = SQUARE_INDEX[from_square]
+        to_index = SQUARE_INDEX[to_square]
+        moving_piece = self.squares[from_index]
+        flag = MOVE_NORMAL
+
+        # If pawn moves diagonally into EMPTY square that equals en_passant_target
+        if moving_piece in ("P", "p") and en_passant_target is not None and turn is not None:
+            direction = -8 if turn == "white" else 8
+            if (
+                    to_square == en_passant_target
+                    and self.squares[to_index] == "."
+                    and to_index - from_index in (direction - 1, direction + 1)
+                    and abs((to_index & 7) - (from_index & 7)) == 1
+            ):
+                flag = MOVE_EN_PASSANT
 
         # Castling: king moves 2 squares horizontally
-        if moving_piece.lower() == "k" and from_row == to_row and abs(to_col - from_col) == 2:
-            undo["castling"] = True
-
-            if to_col > from_col:  # kingside
-                rook_from_col, rook_to_col = 7, 5
-            else:  # queenside
-                rook_from_col, rook_to_col = 0, 3
-
-            rook_from_square = self.index_to_square(from_row, rook_from_col)
-            rook_to_square = self.index_to_square(from_row, rook_to_col)
-
-            undo["rook_from"] = rook_from_square
-            undo["rook_to"] = rook_to_square
-
-            # move king then rook
-            self._move_raw(from_square, to_square)
-            rook_piece = self.get_piece(rook_from_square)
-            self._move_raw(rook_from_square, rook_to_square)
-
-            self._update_moved_flags(from_square, moving_piece)
-            self._update_moved_flags(rook_from_square, rook_piece)
-            return undo
+        if moving_piece in ("K", "k") and from_index >> 3 == to_index >> 3 and abs(to_index - from_index) == 2:
+            flag = MOVE_CASTLING
+
+        return self.apply_move(encode_move(from_index, to_index, flag), undo)
+
+    def apply_move(self, move, undo=None):
+        # pass a record (e.g. from UndoStack.push()) to reuse it instead of allocating one
+        if undo is None:
+            undo = UndoRecord()
+        from_index = move & 63
+        to_index = (move >> 6) & 63
+        flag = (move >> 12) & 7
+        squares = self.squares
+        moving_piece = squares[from_index]
+
+        undo.move = move
+        undo.moved_before = self.moved_mask
+
+        # --- En Passant special move: captured pawn is behind the target square ---
+        if flag == MOVE_EN_PASSANT:
+            capture_index = to_index + 8 if moving_piece == "P" else to_index - 8
+            undo.captured = squares[capture_index]
+            undo.capture_index = capture_index
+            self._put_piece(capture_index, ".")
+        else:
+            undo.captured = squares[to_index]
+            undo.capture_index = to_index
+        # ------------------------------
 
-        # Normal move
-        self._move_raw(from_square, to_square)
-        self._update_moved_flags(from_square, moving_piece)
+        placed = moving_piece
+        if move >> 15:
+            letter = PROMOTION_LETTERS[move >> 15]
+            placed = letter.upper() if moving_piece == "P" else letter
+
+        self._put_piece(from_index, ".")
+        self._put_piece(to_index, placed)
+        self._update_moved_flags(from_index, moving_piece)
+
+        # Castling: move the rook too
+        if flag == MOVE_CASTLING:
+            rook_from, rook_to = CASTLING_ROOK_SQUARES[to_index]
+            rook_piece = squares[rook_from]
+            self._put_piece(rook_from, ".")
+            self._put_piece(rook_to, rook_piece)
+            self._update_moved_flags(rook_from, rook_piece)
+        if self.debug_scores:
+            self.verify_scores()
         return undo
 
     def undo_move(self, undo):
-        self.moved = undo["moved_before"]
-
-        from_square = undo["from"]
-        to_square = undo["to"]
-
-        # --- Undo En Passant ---
-        if undo.get("en_passant"):
-            # move pawn back
-            self._move_raw(to_square, from_square)
-            # restore captured pawn
-            self._set_raw(undo["ep_captured_square"], undo["ep_captured_piece"])
-            return
-        # ----------------------
-
-        if undo["castling"]:
-            rook_from = undo["rook_from"]
-            rook_to = undo["rook_to"]
-            self._move_raw(rook_to, rook_from)
-            self._move_raw(to_square, from_square)
-            return
-
-        moved_piece = self.get_piece(to_square)
-        self._set_raw(to_square, undo["captured"])
-        self._set_raw(from_square, moved_piece)
-
-    def _update_moved_flags(self, from_square, piece_char):
+        move = undo.move
+        from_index = move & 63
+        to_index = (move >> 6) & 63
+        self.moved_mask = undo.moved_before
+
+        piece = self.squares[to_index]
+        if move >> 15:
+            piece = "P" if piece.isupper() else "p"
+
+        if (move >> 12) & 7 == MOVE_CASTLING:
+            rook_from, rook_to = CASTLING_ROOK_SQUARES[to_index]
+            rook_piece = self.squares[rook_to]
+            self._put_piece(rook_to, ".")
+            self._put_piece(rook_from, rook_piece)
+
+        self._put_piece(to_index, ".")
+        self._put_piece(from_index, piece)
+        if undo.captured != ".":
+            self._put_piece(undo.capture_index, undo.captured)
+        if self.debug_scores:
+            self.verify_scores()
+
+    def recompute_scores(self):
+        # full recount of (material, positional), for checking the running totals
+        material = {"white": 0, "black": 0}
+        positional = {"white": 0, "black": 0}
+        for index, piece in enumerate(self.squares):
+            if piece != ".":
+                color = "white" if piece.isupper() else "black"
+                material[color] += PIECE_VALUES[piece.lower()]
+                positional[color] += PIECE_SQUARE_SCORES[piece][index]
+        return material, positional
+
+    def verify_scores(self):
+        material, positional = self.recompute_scores()
+        if material != self.material or positional != self.positional:
+            raise AssertionError(
+                f"running scores {self.material} {self.positional} != recount {material} {positional}"
+            )
+
+    def _update_moved_flags(self, from_index, piece_char):
         if piece_char == "K":
-            self.moved["white_king"] = True
+            self.moved_mask |= MOVED_BITS["white_king"]
         elif piece_char == "k":
-            self.moved["black_king"] = True
+            self.moved_mask |= MOVED_BITS["black_king"]
         elif piece_char == "R":
-            if from_square == "a1":
-                self.moved["white_rook_a"] = True
-            elif from_square == "h1":
-                self.moved["white_rook_h"] = True
+            if from_index == 56:  # a1
+                self.moved_mask |= MOVED_BITS["white_rook_a"]
+            elif from_index == 63:  # h1
+                self.moved_mask |= MOVED_BITS["white_rook_h"]
         elif piece_char == "r":
-            if from_square == "a8":
-                self.moved["black_rook_a"] = True
-            elif from_square == "h8":
-                self.moved["black_rook_h"] = True
-
-
-def path_is_clear(board, from_row, from_col, to_row, to_col):
-    step_row = sign(to_row - from_row)
-    step_col = sign(to_col - from_col)
-    r = from_row + step_row
-    c = from_col + step_col
-    while (r, c) != (to_row, to_col):
-        if board.grid[r][c] != ".":
-            return False
-        r += step_row
-        c += step_col
-    return True
+            if from_index == 0:  # a8
+                self.moved_mask |= MOVED_BITS["black_rook_a"]
+            elif from_index == 7:  # h8
+                self.moved_mask |= MOVED_BITS["black_rook_h"]
 
 
 def find_king(board, color):
-    king_char = "K" if color == "white" else "k"
-    for row in range(8):
-        for col in range(8):
-            if board.grid[row][col] == king_char:
-                return row, col
-    return None
+    index = board.king_squares[color]
+    return None if index is None else divmod(index, 8)
 
 
-def square_is_attacked(board, target_row, target_col, attacker_color):
-    for row in range(8):
-        for col in range(8):
-            piece = board.grid[row][col]
-            if piece == ".":
-                continue
+def index_is_attacked(board, index, attacker_color):
+    # look outward from the target: every attacker has to sit on one of these squares
+    squares = board.squares
 
-            if attacker_color == "white" and not is_white_piece(piece):
-                continue
-            if attacker_color == "black" and not is_black_piece(piece):
-                continue
+    if attacker_color == "white":
+        pawn, knight, bishop, rook, queen, king = "P", "N", "B", "R", "Q", "K"
+        pawn_sources = PAWN_CAPTURES["black"][index]  # a white pawn attacking index stands here
+    else:
+        pawn, knight, bishop, rook, queen, king = "p", "n", "b", "r", "q", "k"
+        pawn_sources = PAWN_CAPTURES["white"][index]
 
-            piece_type = piece.lower()
-            delta_row = target_row - row
-            delta_col = target_col - col
-            abs_row = abs(delta_row)
-            abs_col = abs(delta_col)
+    for source in pawn_sources:
+        if squares[source] == pawn:
+            return True
 
-            if piece_type == "p":
-                direction = -1 if attacker_color == "white" else 1
-                if delta_row == direction and abs_col == 1:
-                    return True
+    for source in KNIGHT_TARGETS[index]:
+        if squares[source] == knight:
+            return True
 
-            elif piece_type == "n":
-                if (abs_row, abs_col) in [(1, 2), (2, 1)]:
-                    return True
+    for source in KING_TARGETS[index]:
+        if squares[source] == king:
+            return True
 
-            elif piece_type == "b":
-                if abs_row == abs_col and abs_row != 0 and path_is_clear(board, row, col, target_row, target_col):
+    # only the first piece along each ray can attack
+    for ray in DIAGONAL_RAYS[index]:
+        for source in ray:
+            piece = squares[source]
+            if piece != ".":
+                if piece == bishop or piece == queen:
                     return True
+                break
 
-            elif piece_type == "r":
-                straight = (delta_row == 0 and delta_col != 0) or (delta_col == 0 and delta_row != 0)
-                if straight and path_is_clear(board, row, col, target_row, target_col):
+    for ray in STRAIGHT_RAYS[index]:
+        for source in ray:
+            piece = squares[source]
+            if piece != ".":
+                if piece == rook or piece == queen:
                     return True
+                break
 
-            elif piece_type == "q":
-                diagonal = (abs_row == abs_col and abs_row != 0)
-                straight = (delta_row == 0 and delta_col != 0) or (delta_col == 0 and delta_row != 0)
-                if (diagonal or straight) and path_is_clear(board, row, col, target_row, target_col):
-                    return True
+    return False
 
-            elif piece_type == "k":
-                if max(abs_row, abs_col) == 1 and (abs_row + abs_col) > 0:
-                    return True
 
-    return False
+def square_is_attacked(board, target_row, target_col, attacker_color):
+    return index_is_attacked(board, target_row * 8 + target_col, attacker_color)
 
 
 def king_in_check(board, color):
-    pos = find_king(board, color)
-    if pos is None:
+    index = board.king_squares[color]
+    if index is None:
         return False
-    king_row, king_col = pos
     attacker = "black" if color == "white" else "white"
-    return square_is_attacked(board, king_row, king_col, attacker)
+    return index_is_attacked(board, index, attacker)
 
 
-def can_castle(board, from_square, to_square, turn):
+def castling_status(board, from_index, to_index, turn):
     if turn == "white":
-        if from_square != "e1":
+        if from_index != 60:
             return False, "Castling: king must start on e1"
-        if board.moved["white_king"]:
+        if board.moved_mask & MOVED_BITS["white_king"]:
             return False, "Castling: king already moved"
     else:
-        if from_square != "e8":
+        if from_index != 4:
             return False, "Castling: king must start on e8"
-        if board.moved["black_king"]:
+        if board.moved_mask & MOVED_BITS["black_king"]:
             return False, "Castling: king already moved"
 
-    from_row, from_col = board.square_to_index(from_square)
-    to_row, to_col = board.square_to_index(to_square)
-
-    if from_row != to_row or abs(to_col - from_col) != 2:
+    if from_index >> 3 != to_index >> 3 or abs(to_index - from_index) != 2:
         return False, "Not a castling move"
 
     if king_in_check(board, turn):
         return False, "Castling: king is currently in check"
 
     opponent = "black" if turn == "white" else "white"
+    rook_piece = "R" if turn == "white" else "r"
 
-    if to_col > from_col:  # kingside
-        rook_square = "h1" if turn == "white" else "h8"
-        rook_piece = "R" if turn == "white" else "r"
+    if to_index > from_index:  # kingside
+        rook_index = from_index + 3
         rook_moved_flag = "white_rook_h" if turn == "white" else "black_rook_h"
-        between_cols = [5, 6]
-        pass_cols = [5, 6]
+        between = (from_index + 1, from_index + 2)
+        passed = (from_index + 1, from_index + 2)
     else:  # queenside
-        rook_square = "a1" if turn == "white" else "a8"
-        rook_piece = "R" if turn == "white" else "r"
+        rook_index = from_index - 4
         rook_moved_flag = "white_rook_a" if turn == "white" else "black_rook_a"
-        between_cols = [1, 2, 3]
-        pass_cols = [3, 2]
+        between = (from_index - 3, from_index - 2, from_index - 1)
+        passed = (from_index - 1, from_index - 2)
 
-    if board.moved[rook_moved_flag]:
+    if board.moved_mask & MOVED_BITS[rook_moved_flag]:
         return False, "Castling: rook already moved"
-    if board.get_piece(rook_square) != rook_piece:
+    if board.squares[rook_index] != rook_piece:
         return False, "Castling: rook is missing"
 
-    for col in between_cols:
-        if board.grid[from_row][col] != ".":
+    for index in between:
+        if board.squares[index] != ".":
             return False, "Castling: squares between are not empty"
 
-    for col in pass_cols:
-        if square_is_attacked(board, from_row, col, opponent):
+    for index in passed:
+        if index_is_attacked(board, index, opponent):
             return False, "Castling: king would pass through/into check"
 
     return True, "ok"
 
 
-def legal_piece_move_only(board, from_square, to_square, turn, en_passant_target):
-    moving_piece = board.get_piece(from_square)
-    target_piece = board.get_piece(to_square)
-
-    if moving_piece == ".":
-        return False, "No piece on the from-square"
-
-    if turn == "white" and not is_white_piece(moving_piece):
-        return False, "It's white's turn"
-    if turn == "black" and not is_black_piece(moving_piece):
-        return False, "It's black's turn"
-
-    if turn == "white" and is_white_piece(target_piece):
-        return False, "Can't capture your own piece"
-    if turn == "black" and is_black_piece(target_piece):
-        return False, "Can't capture your own piece"
-
-    from_row, from_col = board.square_to_index(from_square)
-    to_row, to_col = board.square_to_index(to_square)
+def pseudo_legal_moves_from(board, from_index, turn, en_passant_index):
+    """Packed moves the piece on from_index could make, ignoring checks on its own king.
 
-    delta_row = to_row - from_row
-    delta_col = to_col - from_col
-    abs_row = abs(delta_row)
-    abs_col = abs(delta_col)
+    Castling is the exception: castling_status already rejects castling out of,
+    through or into check, so generated castling moves are fully legal.
+    """
+    squares = board.squares
+    piece = squares[from_index]
+    if piece == ".":
+        return []
+    if turn == "white" and not is_white_piece(piece):
+        return []
+    if turn == "black" and not is_black_piece(piece):
+        return []
 
-    piece_type = moving_piece.lower()
+    is_own = is_white_piece if turn == "white" else is_black_piece
+    piece_type = piece.lower()
+    moves = []
 
     # Pawn
     if piece_type == "p":
-        direction = -1 if turn == "white" else 1
+        direction = -8 if turn == "white" else 8
         start_row = 6 if turn == "white" else 1
-
-        if delta_col == 0 and target_piece == ".":
-            if delta_row == direction:
-                return True, "ok"
-            if from_row == start_row and delta_row == 2 * direction:
-                intermediate_row = from_row + direction
-                if board.grid[intermediate_row][from_col] == ".":
-                    return True, "ok"
-                return False, "Pawn is blocked"
-            return False, "Illegal pawn move"
-
-        if abs_row == 1 and abs_col == 1 and delta_row == direction:
-            # normal capture
-            if target_piece != ".":
-                return True, "ok"
-
-            # en passant capture (diagonal into empty square)
-            if en_passant_target is not None and to_square == en_passant_target:
-                return True, "ok"
-
-            return False, "Pawn capture requires an opponent piece"
-
-        return False, "Illegal pawn move"
-
-    # Knight
-    if piece_type == "n":
-        if (abs_row, abs_col) in [(1, 2), (2, 1)]:
-            return True, "ok"
-        return False, "Illegal knight move"
-
-    # Bishop
+        last_row = 0 if turn == "white" else 7
+        one_step = from_index + direction
+
+        if 0 <= one_step < 64:
+            push_flag = MOVE_PROMOTION if one_step >> 3 == last_row else MOVE_NORMAL
+            if squares[one_step] == ".":
+                moves.append(from_index | (one_step << 6) | (push_flag << 12))
+                two_step = one_step + direction
+                if from_index >> 3 == start_row and squares[two_step] == ".":
+                    moves.append(from_index | (two_step << 6) | (MOVE_DOUBLE_PUSH << 12))
+
+            for to_index in PAWN_CAPTURES[turn][from_index]:
+                target = squares[to_index]
+                if target != "." and not is_own(target):
+                    moves.append(from_index | (to_index << 6) | (push_flag << 12))
+                elif to_index == en_passant_index and target == ".":
+                    moves.append(from_index | (to_index << 6) | (MOVE_EN_PASSANT << 12))
+        return moves
+
+    # Knight / King (fixed offsets)
+    if piece_type in ("n", "k"):
+        targets = KNIGHT_TARGETS if piece_type == "n" else KING_TARGETS
+        for to_index in targets[from_index]:
+            if not is_own(squares[to_index]):
+                moves.append(from_index | (to_index << 6))
+
+        if piece_type == "k":
+            for to_index in (from_index + 2, from_index - 2):
+                if to_index in CASTLING_ROOK_SQUARES:
+                    ok, _ = castling_status(board, from_index, to_index, turn)
+                    if ok:
+                        moves.append(from_index | (to_index << 6) | (MOVE_CASTLING << 12))
+        return moves
+
+    # Sliders (bishop / rook / queen)
     if piece_type == "b":
-        if abs_row == abs_col and abs_row != 0 and path_is_clear(board, from_row, from_col, to_row, to_col):
-            return True, "ok"
-        return False, "Illegal bishop move or path blocked"
+        rays = DIAGONAL_RAYS[from_index]
+    elif piece_type == "r":
+        rays = STRAIGHT_RAYS[from_index]
+    else:
+        rays = QUEEN_RAYS[from_index]
+
+    for ray in rays:
+        for to_index in ray:
+            target = squares[to_index]
+            if is_own(target):
+                break
+            moves.append(from_index | (to_index << 6))
+            if target != ".":
+                break
+    return moves
+
+
+def _trial_move_is_safe(board, move, turn):
+    board.apply_move(move, board.undo_stack.push())
+    illegal = king_in_check(board, turn)
+    board.undo_move(board.undo_stack.pop())
+    return not illegal
+
+
+def checks_and_pins(board, turn):
+    """Look outward from turn's king once.
+
+    Returns (checks, pins, behind_king), all in square indexes:
+    - checks: one set per checking piece, holding the checker's square and the
+      squares between it and the king (capturing or blocking there ends that check)
+    - pins: {square of an absolutely pinned piece: squares it may still move to}
+    - behind_king: squares the king can't retreat to along a slider's check line
+    """
+    squares = board.squares
+    king_index = board.king_squares[turn]
 
-    # Rook
-    if piece_type == "r":
-        straight = (delta_row == 0 and delta_col != 0) or (delta_col == 0 and delta_row != 0)
-        if straight and path_is_clear(board, from_row, from_col, to_row, to_col):
-            return True, "ok"
-        return False, "Illegal rook move or path blocked"
+    if turn == "white":
+        is_own = is_white_piece
+        pawn, knight, bishop, rook, queen = "p", "n", "b", "r", "q"
+    else:
+        is_own = is_black_piece
+        pawn, knight, bishop, rook, queen = "P", "N", "B", "R", "Q"
+
+    checks = []
+    pins = {}
+    behind_king = set()
+
+    for rays, sliders in ((DIAGONAL_RAYS[king_index], (bishop, queen)), (STRAIGHT_RAYS[king_index], (rook, queen))):
+        for ray in rays:
+            line = []
+            pinned = None
+            for index in ray:
+                line.append(index)
+                piece = squares[index]
+                if piece == ".":
+                    continue
+                if is_own(piece):
+                    if pinned is not None:
+                        break
+                    pinned = index
+                    continue
+                if piece in sliders:
+                    if pinned is None:
+                        checks.append(set(line))
+                        behind_king.add(2 * king_index - ray[0])
+                    else:
+                        pins[pinned] = set(line)
+                break
+
+    for index in KNIGHT_TARGETS[king_index]:
+        if squares[index] == knight:
+            checks.append({index})
+
+    for index in PAWN_CAPTURES[turn][king_index]:
+        if squares[index] == pawn:
+            checks.append({index})
+
+    return checks, pins, behind_king
+
+
+def generate_legal_moves(board, turn, en_passant_index, from_index=None):
+    """Legal packed moves for turn (optionally only from one square) without trying them on the board.
+
+    Checkers and pins are computed once; only en passant, which can expose the
+    king along the rank of the two pawns, is checked with a trial move.
+    """
+    if from_index is None:
+        sources = list(board.piece_squares[turn])
+    else:
+        sources = [from_index]
 
-    # Queen
-    if piece_type == "q":
-        diagonal = (abs_row == abs_col and abs_row != 0)
-        straight = (delta_row == 0 and delta_col != 0) or (delta_col == 0 and delta_row != 0)
-        if (diagonal or straight) and path_is_clear(board, from_row, from_col, to_row, to_col):
-            return True, "ok"
-        return False, "Illegal queen move or path blocked"
+    if board.king_squares[turn] is None:
+        moves = []
+        for index in sources:
+            moves.extend(pseudo_legal_moves_from(board, index, turn, en_passant_index))
+        return moves
 
-    # King (+ castling)
-    if piece_type == "k":
-        if delta_row == 0 and abs(delta_col) == 2:
-            return can_castle(board, from_square, to_square, turn)
+    checks, pins, behind_king = checks_and_pins(board, turn)
+    opponent = "black" if turn == "white" else "white"
+    if len(checks) == 1:
+        evasions = checks[0]
+    elif checks:
+        evasions = set()  # double check: only the king may move
+    else:
+        evasions = None
+
+    legal = []
+    for index in sources:
+        piece = board.squares[index]
+        if piece in ("K", "k"):
+            for move in pseudo_legal_moves_from(board, index, turn, en_passant_index):
+                if (move >> 12) & 7 == MOVE_CASTLING:
+                    legal.append(move)  # castling_status already checked every square involved
+                    continue
+                to_index = (move >> 6) & 63
+                if to_index in behind_king:
+                    continue
+                if not index_is_attacked(board, to_index, opponent):
+                    legal.append(move)
+            continue
+
+        if evasions is not None and not evasions:
+            continue
+
+        pin_line = pins.get(index)
+        for move in pseudo_legal_moves_from(board, index, turn, en_passant_index):
+            if (move >> 12) & 7 == MOVE_EN_PASSANT:
+                if _trial_move_is_safe(board, move, turn):
+                    legal.append(move)
+                continue
+            to_index = (move >> 6) & 63
+            if pin_line is not None and to_index not in pin_line:
+                continue
+            if evasions is not None and to_index not in evasions:
+                continue
+            legal.append(move)
+    return legal
+
+
+# --- standard algebraic notation ---
+SAN_PATTERN = re.compile(
+    r"^(?:(?P<long>O-O-O|0-0-0)|(?P<short>O-O|0-0)|"
+    r"(?P<piece>[NBRQK])?(?P<file>[a-h])?(?P<rank>[1-8])?x?(?P<to>[a-h][1-8])(?:=?(?P<promotion>[NBRQ]))?)"
+    r"[+#]?[!?]*$"
+)
+UCI_PATTERN = re.compile(r"^[a-h][1-8][a-h][1-8][qrbn]?$")
+# ------------------------------------
+
+
+class LegalMoveCache:
+    """Bounded LRU map: position key -> tuple of legal packed moves.
+
+    One instance (LEGAL_MOVE_CACHE) is shared by every Game in the process, so
+    rooms replaying the same openings reuse each other's move lists.
+    """
+
+    def __init__(self, max_entries=50_000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            moves = self.entries.get(key)
+            if moves is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return moves
+
+    def put(self, key, moves):
+        with self.lock:
+            self.entries[key] = moves
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+LEGAL_MOVE_CACHE = LegalMoveCache()
+
+
+# --- position formats: FEN and a fixed-size packed encoding ---
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+_FEN_EXPAND = str.maketrans({str(count): "." * count for count in range(1, 9)})
+_EMPTY_RUN = re.compile(r"\.+")
+FEN_PIECES = set("PNBRQKpnbrqk.")
+# FEN castling letter -> (king flag, rook flag, king square, rook square, king, rook)
+FEN_CASTLING = {
+    "K": ("white_king", "white_rook_h", 60, 63, "K", "R"),
+    "Q": ("white_king", "white_rook_a", 60, 56, "K", "R"),
+    "k": ("black_king", "black_rook_h", 4, 7, "k", "r"),
+    "q": ("black_king", "black_rook_a", 4, 0, "k", "r"),
+}
+# castling right -> key used by Game.fen_key (the right's rook flag key)
+FEN_CASTLING_KEYS = {letter: ZOBRIST_CASTLING[rook_flag] for letter, (_, rook_flag, *_) in FEN_CASTLING.items()}
+
+# 32 bytes of pieces (two squares per byte, low nibble first), then
+# flags (bit 0: black to move, bits 1-6: moved mask), en passant index (64 = none),
+# halfmove clock and fullmove number: 38 bytes for any position
+PACKED_POSITION = struct.Struct("<32sBBHH")
+PACKED_POSITION_SIZE = PACKED_POSITION.size
+_PIECE_NIBBLES = {".": 0, "P": 1, "N": 2, "B": 3, "R": 4, "Q": 5, "K": 6,
+                  "p": 9, "n": 10, "b": 11, "r": 12, "q": 13, "k": 14}
+_PAIR_TO_BYTE = {a + b: _PIECE_NIBBLES[a] | (_PIECE_NIBBLES[b] << 4) for a in _PIECE_NIBBLES for b in _PIECE_NIBBLES}
+_BYTE_TO_PAIR = [None] * 256
+for _pair, _byte in _PAIR_TO_BYTE.items():
+    _BYTE_TO_PAIR[_byte] = _pair
+
+
+def _run_length(match):
+    return str(len(match.group()))
+# --------------------------------------------------------------
+
+
+# --- position keys ---
+# per moved mask: the castling rights whose king and rook are both unmoved, as
+# (king square, king, rook square, rook, key); they count once both are still in place
+_CASTLING_CANDIDATES = [
+    tuple(
+        (king_index, king, rook_index, rook, FEN_CASTLING_KEYS[letter])
+        for letter, (king_flag, rook_flag, king_index, rook_index, king, rook) in FEN_CASTLING.items()
+        if not _mask & (MOVED_BITS[king_flag] | MOVED_BITS[rook_flag])
+    )
+    for _mask in range(64)
+]
+
+
+def castling_rights_key(board):
+    # Zobrist part for the castling rights left, the same whichever useless king or
+    # rook moves led here (Game.castling_fen as a key)
+    squares = board.squares
+    key = 0
+    for king_index, king, rook_index, rook, right_key in _CASTLING_CANDIDATES[board.moved_mask]:
+        if squares[king_index] == king and squares[rook_index] == rook:
+            key ^= right_key
+    return key
+
+
+def en_passant_capturable(board, turn, en_passant_index):
+    # whether turn has a legal en passant capture into en_passant_index
+    if turn == "white":
+        pawn, behind = "P", en_passant_index + 8
+    else:
+        pawn, behind = "p", en_passant_index - 8
+    for from_index in (behind - 1, behind + 1):
+        if (from_index >> 3) == (behind >> 3) and board.squares[from_index] == pawn:
+            if _trial_move_is_safe(board, encode_move(from_index, en_passant_index, MOVE_EN_PASSANT), turn):
+                return True
+    return False
 
-        if max(abs_row, abs_col) == 1 and (abs_row + abs_col) > 0:
-            return True, "ok"
-        return False, "Illegal king move"
 
-    return False, "Unknown piece"
+def position_key_for(board, turn, en_passant_index):
+    """Zobrist key of a position for repetition counts and the legal move cache.
 
-def is_pawn_promotion_square(board, square, piece_char):
-    row, col = board.square_to_index(square)
-    return (piece_char == "P" and row == 0) or (piece_char == "p" and row == 7)
+    Positions that FIDE counts as the same get the same key: castling is hashed by
+    the rights left and the en passant file only when the capture is legal.
+    """
+    key = board.piece_key ^ castling_rights_key(board)
+    if turn == "black":
+        key ^= ZOBRIST_BLACK_TO_MOVE
+    if en_passant_index is not None and en_passant_capturable(board, turn, en_passant_index):
+        key ^= ZOBRIST_EN_PASSANT[en_passant_index & 7]
+    return key
+# ---------------------
 
 
 class Game:
@@ -425,12 +950,58 @@ class Game:
         self.turn = "white"
         self.last_message = ""
         self.game_over = False
-        self.result = None  # "checkmate" | "stalemate" | None
+        self.result = None  # "checkmate" | "stalemate" | "threefold_repetition" | "fifty_move_rule" | "insufficient_material" | None
         self.promotion_pending = None  # e.g. "e8" or "a1"
-        self.en_passant_target = None  # e.g. "e3" or "d6" (square that can be captured into)
+        self.en_passant_index = None  # square index that can be captured into (en_passant_target is its name)
         self.move_list = []  # list of strings
         self.pending_promo_text = None  # if a pawn reached last rank, store base move text until user chooses piece
-        self.last_move_text = ""  # last executed move text (e.g. e2→e4, O-O)
+        self.last_move_text = ""  # SAN of the last move, without check marks (e.g. Nf3, exd5, O-O)
+        self.fullmove_number = 1  # FEN move counter, +1 after every black move
+        self.winner = None  # "white" / "black" once a game ends with a winner
+        self.start_fen = None  # FEN the game started from, None for the standard start
+        self._reset_draw_bookkeeping()
+
+    def _reset_draw_bookkeeping(self):
+        # one scan at the start of a game; try_move/promote keep these up to date afterwards
+        self.halfmove_clock = 0  # plies since the last capture or pawn move
+        self.position_counts = Counter()  # position_key -> times seen
+        squares = self.board.squares
+        self.piece_counts = Counter(squares)  # piece char -> count on the board (kings included)
+        del self.piece_counts["."]
+        self.bishop_square_colors = Counter()  # "light"/"dark" -> bishops (both colours) on such squares
+        if self.piece_counts["B"] or self.piece_counts["b"]:
+            for index, piece in enumerate(squares):
+                if piece == "B" or piece == "b":
+                    self.bishop_square_colors["light" if ((index >> 3) + (index & 7)) % 2 == 0 else "dark"] += 1
+        self.position_counts[self.position_key()] += 1
+
+    @property
+    def en_passant_target(self):
+        # e.g. "e3" or "d6"; the name form of en_passant_index
+        return None if self.en_passant_index is None else SQUARE_NAMES[self.en_passant_index]
+
+    @en_passant_target.setter
+    def en_passant_target(self, square):
+        self.en_passant_index = None if square is None else SQUARE_INDEX[square]
+
+    def _add_material(self, piece, index, amount=1):
+        self.piece_counts[piece] += amount
+        if piece in ("B", "b"):
+            self.bishop_square_colors["light" if ((index >> 3) + (index & 7)) % 2 == 0 else "dark"] += amount
+
+    def _remove_material(self, piece, index):
+        self._add_material(piece, index, -1)
+
+    def is_insufficient_material(self):
+        counts = self.piece_counts
+        if counts["P"] or counts["p"] or counts["R"] or counts["r"] or counts["Q"] or counts["q"]:
+            return False
+        knights = counts["N"] + counts["n"]
+        bishops = counts["B"] + counts["b"]
+        if knights + bishops <= 1:
+            return True  # K vs K, K+minor vs K
+        # only bishops left, all on squares of the same colour
+        return knights == 0 and (self.bishop_square_colors["light"] == 0 or self.bishop_square_colors["dark"] == 0)
 
     def reset(self):
         self.board.reset()
@@ -439,59 +1010,209 @@ class Game:
         self.game_over = False
         self.result = None
         self.promotion_pending = None
-        self.en_passant_target = None
+        self.en_passant_index = None
+        self.move_list = []
+        self.pending_promo_text = None
+        self.last_move_text = ""
+        self.fullmove_number = 1
+        self.winner = None
+        self.start_fen = None
+        self._reset_draw_bookkeeping()
+
+    # --- position import / export (a pending promotion is not part of either format) ---
+    def _load_position(self, rows, turn, moved_mask, en_passant_index, halfmove_clock, fullmove_number):
+        self.board.load_rows(rows)
+        self.board.moved_mask = moved_mask
+        self.turn = turn
+        self.last_message = ""
+        self.game_over = False
+        self.result = None
+        self.promotion_pending = None
+        self.en_passant_index = en_passant_index
         self.move_list = []
         self.pending_promo_text = None
         self.last_move_text = ""
+        self.winner = None
+        self.start_fen = None
+        self._reset_draw_bookkeeping()
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+
+    def load_fen(self, fen):
+        # raises ValueError for malformed FEN
+        fields = fen.split()
+        if not 4 <= len(fields) <= 6:
+            raise ValueError(f"FEN needs 4-6 fields: {fen!r}")
+        placement, side, castling, en_passant = fields[:4]
+
+        rows = placement.translate(_FEN_EXPAND).split("/")
+        if len(rows) != 8 or any(len(row) != 8 or not set(row) <= FEN_PIECES for row in rows):
+            raise ValueError(f"Bad FEN piece placement: {placement!r}")
+        if side not in ("w", "b"):
+            raise ValueError(f"Bad FEN side to move: {side!r}")
+
+        moved_mask = 63
+        if castling != "-":
+            for letter in castling:
+                if letter not in FEN_CASTLING:
+                    raise ValueError(f"Bad FEN castling field: {castling!r}")
+                king_flag, rook_flag = FEN_CASTLING[letter][:2]
+                moved_mask &= ~(MOVED_BITS[king_flag] | MOVED_BITS[rook_flag])
+
+        if en_passant == "-":
+            en_passant_index = None
+        elif en_passant in SQUARE_INDEX and en_passant[1] in ("3", "6"):
+            en_passant_index = SQUARE_INDEX[en_passant]
+        else:
+            raise ValueError(f"Bad FEN en passant square: {en_passant!r}")
+
+        try:
+            halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+            fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError(f"Bad FEN move counters: {fen!r}") from None
+        if halfmove_clock < 0 or fullmove_number < 1:
+            raise ValueError(f"Bad FEN move counters: {fen!r}")
+
+        self._load_position(rows, "white" if side == "w" else "black", moved_mask, en_passant_index,
+                            halfmove_clock, fullmove_number)
+        self.start_fen = " ".join(fields)
+
+    @classmethod
+    def from_fen(cls, fen):
+        game = cls()
+        game.load_fen(fen)
+        return game
+
+    def castling_fen(self):
+        # rights that can still be used: king and rook unmoved and on their squares
+        squares = self.board.squares
+        moved_mask = self.board.moved_mask
+        letters = ""
+        for letter, (king_flag, rook_flag, king_index, rook_index, king, rook) in FEN_CASTLING.items():
+            if (
+                    not moved_mask & (MOVED_BITS[king_flag] | MOVED_BITS[rook_flag])
+                    and squares[king_index] == king
+                    and squares[rook_index] == rook
+            ):
+                letters += letter
+        return letters or "-"
+
+    def to_fen(self):
+        squares = self.board.squares
+        placement = _EMPTY_RUN.sub(_run_length, "/".join("".join(squares[start:start + 8]) for start in range(0, 64, 8)))
+        return (
+            f"{placement} {'w' if self.turn == 'white' else 'b'} {self.castling_fen()} "
+            f"{self.en_passant_target or '-'} {self.halfmove_clock} {self.fullmove_number}"
+        )
+
+    def to_packed(self):
+        text = "".join(self.board.squares)
+        pieces = bytes([_PAIR_TO_BYTE[text[start:start + 2]] for start in range(0, 64, 2)])
+        flags = (self.turn == "black") | (self.board.moved_mask << 1)
+        en_passant = 64 if self.en_passant_index is None else self.en_passant_index
+        return PACKED_POSITION.pack(pieces, flags, en_passant, min(self.halfmove_clock, 0xFFFF),
+                                    min(self.fullmove_number, 0xFFFF))
+
+    def load_packed(self, data):
+        # raises ValueError for data that isn't a packed position
+        try:
+            pieces, flags, en_passant, halfmove_clock, fullmove_number = PACKED_POSITION.unpack(data)
+        except struct.error:
+            raise ValueError(f"Packed position must be {PACKED_POSITION_SIZE} bytes") from None
+        try:
+            text = "".join([_BYTE_TO_PAIR[byte] for byte in pieces])
+        except TypeError:
+            raise ValueError("Bad packed piece data") from None
+        if flags >> 7 or en_passant > 64:
+            raise ValueError("Bad packed position flags")
+        rows = [text[start:start + 8] for start in range(0, 64, 8)]
+        self._load_position(rows, "black" if flags & 1 else "white", flags >> 1,
+                            None if en_passant == 64 else en_passant, halfmove_clock, fullmove_number)
+        self.start_fen = self.to_fen()
+
+    @classmethod
+    def from_packed(cls, data):
+        game = cls()
+        game.load_packed(data)
+        return game
+    # ---------------------------------------------------------------------------------
 
     def in_check_now(self, color):
         return king_in_check(self.board, color)
 
     def is_legal_move(self, from_square, to_square):
-        ok, reason = legal_piece_move_only(self.board, from_square, to_square, self.turn, self.en_passant_target)
-
-        if not ok:
-            return False, reason
-
-        undo = self.board.make_move(from_square, to_square, self.en_passant_target, self.turn)
-        illegal = king_in_check(self.board, self.turn)
-        self.board.undo_move(undo)
+        # (ok, reason): the move generator decides, the reason only explains a refusal
+        if from_square not in SQUARE_INDEX or to_square not in SQUARE_INDEX:
+            return False, "Invalid square"
+        if self.find_legal_move(from_square, to_square) is not None:
+            return True, "ok"
 
-        if illegal:
+        piece = self.board.get_piece(from_square)
+        if piece == ".":
+            return False, "No piece on the from-square"
+        if is_white_piece(piece) != (self.turn == "white"):
+            return False, f"It's {self.turn}'s turn"
+        target = self.board.get_piece(to_square)
+        if target != "." and is_white_piece(target) == is_white_piece(piece):
+            return False, "Can't capture your own piece"
+        from_index = SQUARE_INDEX[from_square]
+        to_index = SQUARE_INDEX[to_square]
+        if piece in ("K", "k") and from_index >> 3 == to_index >> 3 and abs(to_index - from_index) == 2:
+            ok, reason = castling_status(self.board, from_index, to_index, self.turn)
+            if not ok:
+                return False, reason
+        pseudo_legal = pseudo_legal_moves_from(self.board, from_index, self.turn, self.en_passant_index)
+        if any((move >> 6) & 63 == to_index for move in pseudo_legal):
             return False, "Illegal: you can't leave your king in check."
-        return True, "ok"
+        if piece in "BRQbrq":
+            return False, f"Illegal {PIECE_NAMES[piece.lower()]} move or path blocked"
+        return False, f"Illegal {PIECE_NAMES[piece.lower()]} move"
+
+    def position_key(self, color=None):
+        # key of the position with `color` (default: side to move) to move, see position_key_for
+        return position_key_for(self.board, color or self.turn, self.en_passant_index)
+
+    def fen_key(self):
+        # like position_key, but with the en passant file whenever the FEN has a target
+        # square, so a game loaded from this position's FEN has the same key (the
+        # network protocol's position hash)
+        key = self.board.piece_key ^ castling_rights_key(self.board)
+        if self.turn == "black":
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        if self.en_passant_index is not None:
+            key ^= ZOBRIST_EN_PASSANT[self.en_passant_index & 7]
+        return key
+
+    def legal_moves(self, color=None):
+        color = color or self.turn
+        key = self.position_key(color)
+        moves = LEGAL_MOVE_CACHE.get(key)
+        if moves is None:
+            moves = tuple(generate_legal_moves(self.board, color, self.en_passant_index))
+            LEGAL_MOVE_CACHE.put(key, moves)
+        return list(moves)
+
+    def legal_moves_from(self, from_square, color=None):
+        from_index = SQUARE_INDEX[from_square]
+        return [move for move in self.legal_moves(color) if move & 63 == from_index]
 
     def legal_destinations_from(self, from_square):
-        destinations = []
-        for row in range(8):
-            for col in range(8):
-                to_square = self.board.index_to_square(row, col)
-                ok, _ = self.is_legal_move(from_square, to_square)
-                if ok:
-                    destinations.append(to_square)
-        return destinations
+        return [SQUARE_NAMES[(move >> 6) & 63] for move in self.legal_moves_from(from_square)]
+
+    def find_legal_move(self, from_square, to_square, promotion=None):
+        # the packed legal move for a pair of square names, or None
+        # (promotion: "q"/"r"/"b"/"n" to play a promotion in one go)
+        to_index = SQUARE_INDEX[to_square]
+        for move in self.legal_moves_from(from_square):
+            if (move >> 6) & 63 == to_index:
+                if promotion is not None and (move >> 12) & 7 == MOVE_PROMOTION:
+                    move = with_promotion(move, promotion)
+                return move
+        return None
 
     def has_any_legal_move(self, color):
-        # temporarily set turn to generate moves for that color, then restore
-        saved_turn = self.turn
-        self.turn = color
-        try:
-            for row in range(8):
-                for col in range(8):
-                    piece = self.board.grid[row][col]
-                    if piece == ".":
-                        continue
-                    if color == "white" and not is_white_piece(piece):
-                        continue
-                    if color == "black" and not is_black_piece(piece):
-                        continue
-
-                    from_sq = self.board.index_to_square(row, col)
-                    if self.legal_destinations_from(from_sq):
-                        return True
-            return False
-        finally:
-            self.turn = saved_turn
+        return bool(self.legal_moves(color))
 
     def update_end_state_for_side_to_move(self):
         # side to move = self.turn
@@ -502,12 +1223,28 @@ class Game:
             self.game_over = True
             if in_check:
                 self.result = "checkmate"
+                self.winner = "black" if self.turn == "white" else "white"
                 self.last_message = f"Checkmate! {'Black' if self.turn == 'white' else 'White'} wins."
             else:
                 self.result = "stalemate"
                 self.last_message = "Stalemate! Draw."
             return
 
+        # --- automatic draws ---
+        draw = None
+        if self.is_insufficient_material():
+            draw = ("insufficient_material", "Draw by insufficient material.")
+        elif self.position_counts[self.position_key()] >= 3:
+            draw = ("threefold_repetition", "Draw by threefold repetition.")
+        elif self.halfmove_clock >= 100:
+            draw = ("fifty_move_rule", "Draw by the fifty-move rule.")
+
+        if draw is not None:
+            self.game_over = True
+            self.result, self.last_message = draw
+            return
+        # -----------------------
+
         # not game over
         base = self.last_move_text or ""  # safety
         if in_check:
@@ -534,33 +1271,102 @@ class Game:
             return False
 
         promoted = piece_letter.upper() if pawn == "P" else piece_letter
-        self.board._set_raw(square, promoted)  # or a public setter if you prefer
+        index = SQUARE_INDEX[square]
+        self.board._put_piece(index, promoted)
+        self._remove_material(pawn, index)
+        self._add_material(promoted, index)
 
         self.promotion_pending = None
 
         final_text = (self.pending_promo_text or "") + piece_letter.upper()
-        self.move_list.append(final_text)
         self.last_move_text = final_text
         self.pending_promo_text = None
 
         # now switch turn and evaluate check/mate/stalemate
         self.turn = "black" if self.turn == "white" else "white"
+        if self.turn == "white":
+            self.fullmove_number += 1
+        self.position_counts[self.position_key()] += 1
         self.update_end_state_for_side_to_move()
+        self.move_list.append(final_text + self._check_mark())
         return True
 
-    def _format_move_text(self, from_square, to_square, moving_piece, captured_piece, was_en_passant):
-        # Castling
-        from_row, from_col = self.board.square_to_index(from_square)
-        to_row, to_col = self.board.square_to_index(to_square)
-        if moving_piece.lower() == "k" and from_row == to_row and abs(to_col - from_col) == 2:
-            return "O-O" if to_col > from_col else "O-O-O"
-
-        # Capture?
-        is_capture = (captured_piece != ".") or was_en_passant
-        arrow = "×" if is_capture else "→"
-        return f"{from_square}{arrow}{to_square}"
+    # --- SAN ---
+    def san_for(self, move):
+        """SAN of a packed move for the side to move, before it is played, without the check mark.
+
+        A promotion move without a piece gets no "=X" part (play_move adds it once chosen).
+        """
+        from_index = move & 63
+        to_index = (move >> 6) & 63
+        flag = (move >> 12) & 7
+        if flag == MOVE_CASTLING:
+            return "O-O" if to_index > from_index else "O-O-O"
+
+        piece = self.board.squares[from_index]
+        capture = self.board.squares[to_index] != "." or flag == MOVE_EN_PASSANT
+        if piece in ("P", "p"):
+            text = (SQUARE_NAMES[from_index][0] + "x" if capture else "") + SQUARE_NAMES[to_index]
+            if move >> 15:
+                text += "=" + PROMOTION_LETTERS[move >> 15].upper()
+            return text
+
+        # name the file, else the rank, else both when another such piece can legally go there too
+        squares = self.board.squares
+        rivals = [
+            other & 63 for other in self.legal_moves()
+            if (other >> 6) & 63 == to_index and other & 63 != from_index and squares[other & 63] == piece
+        ]
+        prefix = ""
+        if rivals:
+            if all(index & 7 != from_index & 7 for index in rivals):
+                prefix = SQUARE_NAMES[from_index][0]
+            elif all(index >> 3 != from_index >> 3 for index in rivals):
+                prefix = SQUARE_NAMES[from_index][1]
+            else:
+                prefix = SQUARE_NAMES[from_index]
+        return piece.upper() + prefix + ("x" if capture else "") + SQUARE_NAMES[to_index]
+
+    def _check_mark(self):
+        # after the move and the end-state update: "#" for mate, "+" for check
+        if self.result == "checkmate":
+            return "#"
+        return "+" if self.in_check_now(self.turn) else ""
+
+    def find_san_move(self, san):
+        """The packed legal move (with its promotion piece) written as san, or None if
+        there is none or san fits more than one."""
+        match = SAN_PATTERN.match(san.strip())
+        if match is None:
+            return None
+        legal = self.legal_moves()
+        if match.group("long") or match.group("short"):
+            kingside = match.group("short") is not None
+            castles = [move for move in legal
+                       if (move >> 12) & 7 == MOVE_CASTLING and ((move >> 6) & 63 > (move & 63)) == kingside]
+            return castles[0] if len(castles) == 1 else None
+
+        piece = match.group("piece") or "P"
+        to_index = SQUARE_INDEX[match.group("to")]
+        from_file = match.group("file")
+        from_rank = match.group("rank")
+        promotion = match.group("promotion")
+        found = []
+        for move in legal:
+            from_index = move & 63
+            if (move >> 6) & 63 != to_index or self.board.squares[from_index].upper() != piece:
+                continue
+            if (from_file and SQUARE_NAMES[from_index][0] != from_file) or (
+                    from_rank and SQUARE_NAMES[from_index][1] != from_rank):
+                continue
+            if ((move >> 12) & 7 == MOVE_PROMOTION) != (promotion is not None):
+                continue
+            found.append(with_promotion(move, promotion.lower()) if promotion else move)
+        return found[0] if len(found) == 1 else None
+    # ---------
 
-    def try_move(self, from_square, to_square):
+    def try_move(self, from_square, to_square, promotion=None):
+        # string boundary: validate the squares, then play the packed move
         if self.game_over:
             self.last_message = "Game over. Press New Game."
             return False
@@ -574,45 +1380,168 @@ class Game:
             self.last_message = reason
             return False
 
-        moving_piece = self.board.get_piece(from_square)
-        captured_piece = self.board.get_piece(to_square)  # normal capture is on destination
+        return self.play_move(self.find_legal_move(from_square, to_square, promotion))
 
-        # make move
-        undo = self.board.make_move(from_square, to_square, self.en_passant_target, self.turn)
+    def play_move(self, move):
+        """Play a packed move from legal_moves() for the side to move.
+
+        A promotion without a piece in the move leaves promotion_pending set
+        until promote() is called, like a move entered on the board.
+        """
+        if self.game_over or self.promotion_pending is not None:
+            return False
 
-        was_en_passant = bool(undo.get("en_passant"))
-        move_text = self._format_move_text(from_square, to_square, moving_piece, captured_piece, was_en_passant)
+        from_index = move & 63
+        to_index = (move >> 6) & 63
+        flag = (move >> 12) & 7
+        moving_piece = self.board.piece_at(from_index)
+        promotion = move_promotion(move)
+        move_text = self.san_for(move & 0x7FFF)
+
+        # make move (the pawn is promoted by promote() below, not by the board)
+        undo = self.board.apply_move(move & 0x7FFF)
+        captured_piece = undo.captured
         self.last_move_text = move_text
 
-        moved_piece = self.board.get_piece(to_square)
+        if captured_piece != ".":
+            self._remove_material(captured_piece, undo.capture_index)
+
+        if moving_piece in ("P", "p") or captured_piece != ".":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
 
-        # --- NEW: promotion pending? ---
-        if moved_piece.lower() == "p" and is_pawn_promotion_square(self.board, to_square, moved_piece):
-            self.promotion_pending = to_square
+        # --- promotion pending? ---
+        if flag == MOVE_PROMOTION:
+            self.en_passant_index = None
+            self.promotion_pending = SQUARE_NAMES[to_index]
             self.pending_promo_text = move_text + "="  # we'll append Q/R/B/N later
             self.last_message = f"{move_text} (promotion)"
+            if promotion is not None:
+                self.promote(promotion)
             return True
         # --------------------------------
 
-        # Reset en passant by default (only lasts for one opponent move)
-        new_ep_target = None
-
-        moved_piece = self.board.get_piece(to_square)
-        from_row, from_col = self.board.square_to_index(from_square)
-        to_row, to_col = self.board.square_to_index(to_square)
-
-        # If a pawn just moved two squares, set en passant target to the jumped-over square
-        if moved_piece.lower() == "p" and abs(to_row - from_row) == 2:
-            jumped_row = (from_row + to_row) // 2
-            jumped_square = self.board.index_to_square(jumped_row, to_col)
-            new_ep_target = jumped_square
-
-        self.en_passant_target = new_ep_target
-
-        self.move_list.append(move_text)
+        # en passant only lasts for one opponent move: the square a pawn just jumped over
+        if flag == MOVE_DOUBLE_PUSH:
+            self.en_passant_index = (from_index + to_index) // 2
+        else:
+            self.en_passant_index = None
 
         # normal flow
         self.turn = "black" if self.turn == "white" else "white"
+        if self.turn == "white":
+            self.fullmove_number += 1
+        self.position_counts[self.position_key()] += 1
         self.update_end_state_for_side_to_move()
+        self.move_list.append(move_text + self._check_mark())
         return True
 
+    # --- bulk replay ---
+    def replay(self, moves, strict=False):
+        """Play a recorded move sequence (UCI or SAN strings, or packed moves) and return the ply count.
+
+        Unlike try_move, the end of the game (mate, stalemate, draws) is only
+        looked for once, after the last move, and no messages are built on the
+        way. By default each move only gets cheap sanity checks (a piece of the
+        side to move, not capturing its own side, a promotion piece where one
+        is needed); strict=True checks every move against the legal moves.
+        Raises ValueError for a move that fails the checks; the moves before it
+        stay played.
+        """
+        plies = 0
+        for _ in self.iter_replay(moves, strict):
+            plies += 1
+        if plies:
+            self.update_end_state_for_side_to_move()
+            if self.result == "checkmate":
+                self.move_list[-1] = self.last_move_text + "#"
+        return plies
+
+    def iter_replay(self, moves, strict=False):
+        # replay() one move at a time: yields the packed move after playing it,
+        # for callers that look at every position (the end state is not updated)
+        if self.game_over or self.promotion_pending is not None:
+            raise ValueError("Game is over or waiting for a promotion.")
+        for ply, move in enumerate(moves):
+            if isinstance(move, str) and not UCI_PATTERN.match(move):
+                san = move
+                move = self.find_san_move(san)  # SAN is always matched against the legal moves
+                if move is None:
+                    raise ValueError(f"Illegal or ambiguous move {san!r} at ply {ply}")
+            elif isinstance(move, str):
+                move = self._parse_replay_move(move, strict, ply)
+            elif strict and move & 0x7FFF not in self.legal_moves():
+                raise ValueError(f"Illegal move {move_to_uci(move)} at ply {ply}")
+            self._check_replay_move(move, ply)
+            self._replay_move(move)
+            yield move
+
+    def _parse_replay_move(self, uci, strict, ply):
+        from_square, to_square, promotion = uci[0:2], uci[2:4], uci[4:] or None
+        if from_square not in SQUARE_INDEX or to_square not in SQUARE_INDEX or promotion not in (None, *"qrbn"):
+            raise ValueError(f"Bad move {uci!r} at ply {ply}")
+        if strict:
+            move = self.find_legal_move(from_square, to_square, promotion)
+            if move is None:
+                raise ValueError(f"Illegal move {uci} at ply {ply}")
+            return move
+
+        # rebuild the flag the string leaves out from the board
+        from_index = SQUARE_INDEX[from_square]
+        to_index = SQUARE_INDEX[to_square]
+        piece = self.board.squares[from_index]
+        flag = MOVE_NORMAL
+        if piece == "P" or piece == "p":
+            if to_index >> 3 in (0, 7):
+                flag = MOVE_PROMOTION
+            elif abs(to_index - from_index) == 16:
+                flag = MOVE_DOUBLE_PUSH
+            elif to_index == self.en_passant_index and (to_index - from_index) & 7:
+                flag = MOVE_EN_PASSANT
+        elif (piece == "K" or piece == "k") and abs(to_index - from_index) == 2:
+            flag = MOVE_CASTLING
+        return encode_move(from_index, to_index, flag, PROMOTION_LETTERS.find(promotion) if promotion else 0)
+
+    def _check_replay_move(self, move, ply):
+        squares = self.board.squares
+        piece = squares[move & 63]
+        target = squares[(move >> 6) & 63]
+        own = is_white_piece if self.turn == "white" else is_black_piece
+        if not own(piece) or own(target):
+            raise ValueError(f"Move {move_to_uci(move)} at ply {ply} does not fit the position")
+        if ((move >> 12) & 7 == MOVE_PROMOTION) != bool(move >> 15):
+            raise ValueError(f"Move {move_to_uci(move)} at ply {ply} needs a promotion piece")
+
+    def _replay_move(self, move):
+        # play_move's bookkeeping for a move that is trusted and carries its promotion piece
+        from_index = move & 63
+        to_index = (move >> 6) & 63
+        flag = (move >> 12) & 7
+        moving_piece = self.board.squares[from_index]
+        move_text = self.san_for(move)
+        undo = self.board.apply_move(move & 0x7FFF)
+        captured_piece = undo.captured
+
+        if captured_piece != ".":
+            self._remove_material(captured_piece, undo.capture_index)
+        if moving_piece in ("P", "p") or captured_piece != ".":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+
+        if flag == MOVE_PROMOTION:
+            letter = PROMOTION_LETTERS[move >> 15]
+            promoted = letter.upper() if moving_piece == "P" else letter
+            self.board._put_piece(to_index, promoted)
+            self._remove_material(moving_piece, to_index)
+            self._add_material(promoted, to_index)
+        self.en_passant_index = (from_index + to_index) // 2 if flag == MOVE_DOUBLE_PUSH else None
+
+        self.last_move_text = move_text
+        self.turn = "black" if self.turn == "white" else "white"
+        if self.turn == "white":
+            self.fullmove_number += 1
+        self.position_counts[self.position_key()] += 1
+        self.move_list.append(move_text + ("+" if self.in_check_now(self.turn) else ""))
+    # -------------------
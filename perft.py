@@ -0,0 +1,318 @@
+# perft.py
+#
+# Move-generation benchmark and regression check for engine.py.
+# perft(depth) counts the leaf nodes of the legal move tree; the counts for the
+# positions in SUITE are well known, so any rules bug (castling, en passant,
+# promotion, pins...) shows up as a wrong number.
+#
+#   python perft.py                      # run the suite up to depth 3
+#   python perft.py --suite --depth 4
+#   python perft.py --fen "<fen>" --depth 4 --divide --workers 4
+#   python perft.py --memory --depth 3     # allocation / GC pressure of make/undo
+#   python perft.py --codecs               # FEN / packed position encode and decode throughput
+#   python perft.py --batch 4000           # batch.py (NumPy) legal move counts vs the engine
+
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from engine import (
+    MOVE_DOUBLE_PUSH, MOVE_PROMOTION, START_FEN, Game, generate_legal_moves, king_in_check, move_to_uci,
+)
+
+# (name, fen, {depth: expected leaf nodes})
+SUITE = [
+    ("start", START_FEN,
+     {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+]
+
+# promotion field values of a packed move: q, r, b, n
+PROMOTION_CODES = (1, 2, 3, 4)
+
+
+def expand_promotions(moves):
+    # the engine asks for the promotion piece afterwards; perft counts each choice
+    for move in moves:
+        if (move >> 12) & 7 == MOVE_PROMOTION:
+            for code in PROMOTION_CODES:
+                yield move | (code << 15)
+        else:
+            yield move
+
+
+def make_perft_move(game, move):
+    board = game.board
+    saved = game.en_passant_index
+    board.apply_move(move, board.undo_stack.push())
+    if (move >> 12) & 7 == MOVE_DOUBLE_PUSH:
+        game.en_passant_index = ((move & 63) + ((move >> 6) & 63)) // 2
+    else:
+        game.en_passant_index = None
+    game.turn = "black" if game.turn == "white" else "white"
+    return saved
+
+
+def unmake_perft_move(game, saved):
+    game.turn = "black" if game.turn == "white" else "white"
+    game.en_passant_index = saved
+    game.board.undo_move(game.board.undo_stack.pop())
+
+
+def perft(game, depth):
+    if depth == 0:
+        return 1
+    moves = generate_legal_moves(game.board, game.turn, game.en_passant_index)
+    if depth == 1:
+        return sum(4 if (move >> 12) & 7 == MOVE_PROMOTION else 1 for move in moves)
+
+    nodes = 0
+    for move in expand_promotions(moves):
+        saved = make_perft_move(game, move)
+        nodes += perft(game, depth - 1)
+        unmake_perft_move(game, saved)
+    return nodes
+
+
+def _perft_root_move(args):
+    # runs in a worker process: rebuild the position, play one root move, count below it
+    fen, name, depth = args
+    game = Game.from_fen(fen)
+    moves = generate_legal_moves(game.board, game.turn, game.en_passant_index)
+    for move in expand_promotions(moves):
+        if move_to_uci(move) == name:
+            make_perft_move(game, move)
+            return name, perft(game, depth - 1)
+    raise ValueError(f"Root move {name} not legal in {fen}")
+
+
+def divide(fen, depth, workers=1):
+    """Leaf nodes below each root move, as {move name (e.g. "e2e4", "e7e8q"): count}.
+
+    With workers > 1 the root moves are split across a process pool.
+    """
+    game = Game.from_fen(fen)
+    moves = generate_legal_moves(game.board, game.turn, game.en_passant_index)
+    names = [move_to_uci(move) for move in expand_promotions(moves)]
+    if depth < 1:
+        return {}
+
+    jobs = [(fen, name, depth) for name in names]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return dict(pool.map(_perft_root_move, jobs))
+    return dict(_perft_root_move(job) for job in jobs)
+
+
+def run_perft(fen, depth, workers=1, show_divide=False, out=sys.stdout):
+    """Count nodes to `depth` from `fen` and print the total and nodes/second.
+
+    Returns (nodes, seconds).
+    """
+    started = time.perf_counter()
+    counts = divide(fen, depth, workers)
+    elapsed = time.perf_counter() - started
+    nodes = sum(counts.values()) if depth > 0 else 1
+
+    if show_divide:
+        for name in sorted(counts):
+            print(f"{name}: {counts[name]}", file=out)
+    nps = nodes / elapsed if elapsed > 0 else 0.0
+    print(f"depth {depth}: {nodes} nodes in {elapsed:.3f}s ({nps:,.0f} nodes/s)", file=out)
+    return nodes, elapsed
+
+
+def run_suite(max_depth, workers=1, out=sys.stdout):
+    """Check every SUITE position up to max_depth. Returns the list of mismatches."""
+    failures = []
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, expected in SUITE:
+        for depth in sorted(expected):
+            if depth > max_depth:
+                break
+            started = time.perf_counter()
+            nodes = sum(divide(fen, depth, workers).values())
+            elapsed = time.perf_counter() - started
+            total_nodes += nodes
+            total_time += elapsed
+
+            status = "ok" if nodes == expected[depth] else "FAIL"
+            nps = nodes / elapsed if elapsed > 0 else 0.0
+            print(f"{status:4} {name} depth {depth}: {nodes} (expected {expected[depth]}) "
+                  f"{elapsed:.3f}s {nps:,.0f} nodes/s", file=out)
+            if nodes != expected[depth]:
+                failures.append((name, depth, nodes, expected[depth]))
+
+    nps = total_nodes / total_time if total_time > 0 else 0.0
+    print(f"total: {total_nodes} nodes in {total_time:.3f}s ({nps:,.0f} nodes/s), "
+          f"{len(failures)} failure(s)", file=out)
+    return failures
+
+
+def _undo_bytes(game, move, use_stack):
+    # memory still held after one make_move, i.e. what every open ply of a search keeps alive
+    board = game.board
+    undo = board.undo_stack.push() if use_stack else None
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    undo = board.apply_move(move, undo)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    board.undo_move(undo)
+    if use_stack:
+        board.undo_stack.pop()
+    return after - before
+
+
+def measure_memory(fen, depth, out=sys.stdout):
+    """Memory held per ply by undo information, plus a perft run's peak memory and GC collections.
+
+    Generation-0 collections are triggered by surviving allocations of
+    GC-tracked objects, so their count shows how much garbage make/undo leaves.
+    """
+    game = Game.from_fen(fen)
+    move = generate_legal_moves(game.board, game.turn, game.en_passant_index)[0]
+    per_ply = _undo_bytes(game, move, use_stack=False)
+    per_ply_stack = _undo_bytes(game, move, use_stack=True)
+
+    gc.collect()
+    collections_before = sum(stat["collections"] for stat in gc.get_stats())
+    tracemalloc.start()
+    started = time.perf_counter()
+    nodes = perft(game, depth)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    collections = sum(stat["collections"] for stat in gc.get_stats()) - collections_before
+
+    print(f"undo info per ply: {per_ply} bytes allocated, {per_ply_stack} bytes with UndoStack", file=out)
+    print(f"depth {depth}: {nodes} nodes in {elapsed:.3f}s, peak traced memory {peak / 1024:.1f} KiB, "
+          f"{collections} GC collections", file=out)
+    return per_ply, per_ply_stack, peak, collections
+
+
+def measure_codecs(rounds=2000, out=sys.stdout):
+    """Encode/decode throughput of Game.to_fen/from_fen and to_packed/from_packed over the SUITE positions.
+
+    Returns {format: (encodes per second, decodes per second)}.
+    """
+    games = [Game.from_fen(fen) for _, fen, _ in SUITE]
+    target = Game()
+    results = {}
+    for name, encode, decode in (
+            ("fen", Game.to_fen, Game.load_fen),
+            ("packed", Game.to_packed, Game.load_packed),
+    ):
+        encoded = [encode(game) for game in games]
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for game in games:
+                encode(game)
+        encode_rate = rounds * len(games) / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for data in encoded:
+                decode(target, data)
+        decode_rate = rounds * len(games) / (time.perf_counter() - started)
+
+        size = sum(len(data) for data in encoded) / len(encoded)
+        print(f"{name}: {size:.1f} bytes/position, encode {encode_rate:,.0f}/s, decode {decode_rate:,.0f}/s", file=out)
+        results[name] = (encode_rate, decode_rate)
+    return results
+
+
+def sample_positions(count, seed=1):
+    """count Games reached by random legal moves from the SUITE positions (for batch checks)."""
+    rng = random.Random(seed)
+    games = []
+    while len(games) < count:
+        game = Game.from_fen(SUITE[len(games) % len(SUITE)][1])
+        for _ in range(rng.randrange(60)):
+            moves = list(expand_promotions(generate_legal_moves(game.board, game.turn, game.en_passant_index)))
+            if not moves:
+                break
+            make_perft_move(game, rng.choice(moves))
+        games.append(game)
+    return games
+
+
+def measure_batch(count=4000, out=sys.stdout):
+    """Check batch.legal_move_counts / in_check against the engine on sampled positions and compare speed.
+
+    Returns the number of positions where the two disagree.
+    """
+    import batch  # needs numpy; the rest of this tool does not
+
+    games = sample_positions(count)
+    started = time.perf_counter()
+    expected = [sum(4 if (move >> 12) & 7 == MOVE_PROMOTION else 1
+                    for move in generate_legal_moves(game.board, game.turn, game.en_passant_index))
+                for game in games]
+    expected_check = [king_in_check(game.board, game.turn) for game in games]
+    scalar = time.perf_counter() - started
+
+    positions = batch.positions_from_games(games)
+    started = time.perf_counter()
+    counts = batch.legal_move_counts(positions["boards"], positions["white_to_move"],
+                                     positions["castling"], positions["en_passant"])
+    checks = batch.in_check(positions["boards"], positions["white_to_move"])
+    vectorized = time.perf_counter() - started
+
+    mismatches = sum(1 for number in range(count)
+                     if counts[number] != expected[number] or checks[number] != expected_check[number])
+    print(f"{count} positions: engine {count / scalar:,.0f}/s, batch {count / vectorized:,.0f}/s, "
+          f"{mismatches} mismatch(es)", file=out)
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft benchmark and move generator check.")
+    parser.add_argument("--fen", help="position to count from (default: run the suite)")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--divide", action="store_true", help="print node counts per root move")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes to split root moves across")
+    parser.add_argument("--suite", action="store_true", help="run the built-in positions")
+    parser.add_argument("--memory", action="store_true", help="measure allocations instead of speed")
+    parser.add_argument("--codecs", action="store_true", help="benchmark FEN / packed position encoding")
+    parser.add_argument("--batch", type=int, metavar="N",
+                        help="check and time the NumPy batch legality functions on N sampled positions")
+    args = parser.parse_args(argv)
+
+    if args.batch:
+        return 1 if measure_batch(args.batch) else 0
+
+    if args.codecs:
+        measure_codecs()
+        return 0
+
+    if args.memory:
+        measure_memory(args.fen or START_FEN, args.depth)
+        return 0
+
+    if args.fen and not args.suite:
+        run_perft(args.fen, args.depth, args.workers, args.divide)
+        return 0
+
+    failures = run_suite(args.depth, args.workers)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+# pgn.py
+#
+# PGN export of games and a streaming PGN reader. read_pgn() walks a file of
+# any size one game at a time; validate_stream() replays the games in a pool
+# of worker processes, keeping only a bounded number of batches in flight, so
+# memory stays flat however big the input is.
+#
+#   python pgn.py games.pgn                      # one JSON line per game on stdout
+#   python pgn.py games.pgn --out results.jsonl --workers 4
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from engine import START_FEN, Game
+
+SEVEN_TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+GAME_RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+DRAW_RESULTS = {"stalemate", "threefold_repetition", "fifty_move_rule", "insufficient_material", "draw_agreed"}
+LINE_WIDTH = 80
+BATCH_SIZE = 64  # games per worker task
+MAX_BATCHES_IN_FLIGHT = 4  # per worker
+
+_TAG = re.compile(r'^\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]\s*$')
+_COMMENT = re.compile(r"\{[^}]*\}")
+_VARIATION = re.compile(r"\([^()]*\)")  # innermost first; repeated until none are left
+_MOVE_NUMBER = re.compile(r"^\d+\.+")
+
+
+# --- export ---
+def game_result(game):
+    # PGN result token for a Game
+    if game.winner is not None:
+        return "1-0" if game.winner == "white" else "0-1"
+    if game.result in DRAW_RESULTS:
+        return "1/2-1/2"
+    return "*"
+
+
+def game_to_pgn(game, headers=None):
+    """PGN text of a game's moves (Game.move_list, which is SAN) with the Seven Tag Roster.
+
+    headers overrides or adds tags; missing roster tags get PGN's "unknown" values.
+    """
+    tags = {"Event": "?", "Site": "?", "Date": date.today().strftime("%Y.%m.%d"), "Round": "-",
+            "White": "?", "Black": "?", "Result": game_result(game)}
+    if game.start_fen is not None and game.start_fen != START_FEN:
+        tags["SetUp"] = "1"
+        tags["FEN"] = game.start_fen
+    tags.update(headers or {})
+
+    lines = [f'[{name} "{_escape(value)}"]' for name, value in tags.items()]
+    lines.append("")
+
+    # move numbers count from the start position's fullmove number
+    number, black_first = 1, False
+    if game.start_fen is not None:
+        fields = game.start_fen.split()
+        black_first = fields[1] == "b"
+        number = int(fields[5]) if len(fields) > 5 else 1
+    tokens = []
+    for ply, san in enumerate(game.move_list):
+        white_move = (ply % 2 == 0) != black_first
+        if white_move:
+            tokens.append(f"{number}.")
+        elif ply == 0:
+            tokens.append(f"{number}...")
+        tokens.append(san)
+        if not white_move:
+            number += 1
+    tokens.append(tags["Result"])
+
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_WIDTH:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+# --------------
+
+
+# --- reading ---
+def read_pgn(lines):
+    """Yield (tags dict, movetext) for each game in an iterable of PGN lines (e.g. an open file).
+
+    Only the game being read is held in memory.
+    """
+    tags = {}
+    movetext = []
+    in_comment = False  # inside a {...} comment that spans lines
+    for line in lines:
+        line = line.strip()
+        if not in_comment:
+            if line.startswith("%"):
+                continue  # escape mechanism: the rest of the line is ignored
+            match = _TAG.match(line)
+            if match:
+                if movetext:
+                    yield tags, " ".join(movetext)
+                    tags, movetext = {}, []
+                tags[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+                continue
+        if line:
+            line, in_comment = _cut_rest_of_line_comment(line, in_comment)
+            movetext.append(line)
+    if tags or movetext:
+        yield tags, " ".join(movetext)
+
+
+def _cut_rest_of_line_comment(line, in_comment):
+    # (line up to a ";" comment, whether a {...} comment is still open at its end);
+    # a ";" inside braces is comment text, and a "{" after ";" opens nothing
+    position = 0
+    while True:
+        if in_comment:
+            end = line.find("}", position)
+            if end < 0:
+                return line, True
+            in_comment = False
+            position = end + 1
+        else:
+            semicolon = line.find(";", position)
+            brace = line.find("{", position)
+            if semicolon >= 0 and (brace < 0 or semicolon < brace):
+                return line[:semicolon], False
+            if brace < 0:
+                return line, False
+            in_comment = True
+            position = brace + 1
+
+
+def movetext_sans(movetext):
+    """(SAN moves, result token or None) of a game's movetext; comments, variations,
+    NAGs and move numbers are dropped."""
+    text = _COMMENT.sub(" ", movetext)
+    while "(" in text:
+        text, replaced = _VARIATION.subn(" ", text)
+        if not replaced:
+            raise ValueError("Unbalanced variation parentheses")
+    sans = []
+    result = None
+    for token in text.split():
+        token = _MOVE_NUMBER.sub("", token)
+        if not token or token.startswith("$"):
+            continue
+        if token in GAME_RESULTS:
+            result = token
+            continue
+        sans.append(token)
+    return sans, result
+
+
+def validate_game(number, tags, movetext):
+    """Replay one game strictly (every SAN move must be legal and unambiguous) and
+    describe it as a JSON-ready dict."""
+    report = {"game": number, "white": tags.get("White"), "black": tags.get("Black"),
+              "result": tags.get("Result"), "valid": False, "plies": 0}
+    try:
+        sans, result = movetext_sans(movetext)
+        game = Game.from_fen(tags["FEN"]) if "FEN" in tags else Game()
+        for _ in game.iter_replay(sans, strict=True):
+            report["plies"] += 1
+        if report["plies"]:
+            game.update_end_state_for_side_to_move()
+    except ValueError as e:
+        report["error"] = str(e)
+        return report
+
+    report["valid"] = True
+    report["end"] = game.result
+    report["final_fen"] = game.to_fen()
+    # a mate or automatic draw on the board has to agree with the Result tag
+    board_result = game_result(game)
+    claimed = tags.get("Result", result)
+    if board_result != "*" and claimed not in (None, "*", board_result):
+        report["valid"] = False
+        report["error"] = f"Result {claimed} does not match the final position ({board_result})"
+    return report
+
+
+def _validate_batch(batch):
+    # runs in a worker process
+    return [validate_game(number, tags, movetext) for number, tags, movetext in batch]
+
+
+def _batches(games, size):
+    batch = []
+    for number, (tags, movetext) in enumerate(games):
+        batch.append((number, tags, movetext))
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def validate_stream(games, workers=1, batch_size=BATCH_SIZE):
+    """Yield validate_game reports, in input order, for an iterable of (tags, movetext).
+
+    With workers > 1 the games are replayed in a process pool; at most
+    MAX_BATCHES_IN_FLIGHT batches per worker are read ahead of the results.
+    """
+    if workers <= 1:
+        for batch in _batches(games, batch_size):
+            yield from _validate_batch(batch)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for batch in _batches(games, batch_size):
+            in_flight.append(pool.submit(_validate_batch, batch))
+            if len(in_flight) >= workers * MAX_BATCHES_IN_FLIGHT:
+                yield from in_flight.popleft().result()
+        while in_flight:
+            yield from in_flight.popleft().result()
+# ---------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate the games of a PGN file, one JSON line per game.")
+    parser.add_argument("pgn", help="PGN file to read")
+    parser.add_argument("--out", help="JSON lines output file (default: stdout)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="validation processes")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    games = invalid = 0
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    try:
+        with open(args.pgn, encoding="utf-8", errors="replace") as f:
+            for report in validate_stream(read_pgn(f), args.workers):
+                out.write(json.dumps(report) + "\n")
+                games += 1
+                invalid += not report["valid"]
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - started
+    rate = games / elapsed if elapsed > 0 else 0.0
+    print(f"{games} games, {invalid} invalid, {elapsed:.1f}s ({rate:,.0f} games/s)", file=sys.stderr)
+    return 1 if invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,466 @@
+# search.py
+#
+# Move search on top of engine.py: negamax alpha-beta with iterative deepening,
+# a fixed-size transposition table, MVV-LVA / killer / history move ordering and
+# a captures-only quiescence search.
+#
+#   python search.py --fen "<fen>" --time 5        # best move for a position
+#   python search.py --bench --depth 4             # fixed-depth benchmark over the perft positions
+
+import argparse
+import sys
+import time
+
+from engine import (
+    START_FEN,
+    Board,
+    Game,
+    MOVE_DOUBLE_PUSH,
+    MOVE_EN_PASSANT,
+    MOVE_PROMOTION,
+    PIECE_VALUES,
+    generate_legal_moves,
+    king_in_check,
+    move_to_uci,
+    position_key_for,
+)
+
+MATE_SCORE = 100000
+MATE_BOUND = MATE_SCORE - 1000  # scores beyond this are "mate in n"
+INFINITY = MATE_SCORE + 1
+MAX_PLY = 64
+
+# transposition table bounds
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+PROMOTION_ORDER = (1, 4, 2, 3)  # q, n, r, b (packed promotion codes)
+CHECK_EVERY = 1024  # nodes between time / stop checks
+
+
+def evaluate(board, turn):
+    # material + piece-square score from the side to move's point of view (kept up to date by the Board)
+    material = board.material
+    positional = board.positional
+    score = material["white"] - material["black"] + positional["white"] - positional["black"]
+    return score if turn == "white" else -score
+
+
+def expand_promotions(moves):
+    # a generated promotion has no piece yet; search every choice, queen first
+    expanded = []
+    for move in moves:
+        if (move >> 12) & 7 == MOVE_PROMOTION:
+            expanded.extend(move | (code << 15) for code in PROMOTION_ORDER)
+        else:
+            expanded.append(move)
+    return expanded
+
+
+class SearchAborted(Exception):
+    pass
+
+
+class TranspositionTable:
+    """Fixed number of slots (2 ** size_bits), so memory stays bounded.
+
+    Slot = key & mask; an entry is (key, depth, score, bound, move). A new
+    entry replaces a different position, or the same one searched less deep.
+    """
+
+    def __init__(self, size_bits=18):
+        self.mask = (1 << size_bits) - 1
+        self.slots = [None] * (1 << size_bits)
+        self.used = 0
+        self.probes = 0
+        self.hits = 0
+
+    def get(self, key):
+        self.probes += 1
+        entry = self.slots[key & self.mask]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def put(self, key, depth, score, bound, move):
+        index = key & self.mask
+        old = self.slots[index]
+        if old is None:
+            self.used += 1
+        elif old[0] == key and old[1] > depth and bound != EXACT:
+            return
+        self.slots[index] = (key, depth, score, bound, move)
+
+    def clear(self):
+        self.slots = [None] * len(self.slots)
+        self.used = 0
+        self.probes = 0
+        self.hits = 0
+
+    def stats(self):
+        return {"size": len(self.slots), "used": self.used, "probes": self.probes, "hits": self.hits}
+
+
+class Searcher:
+    """Finds a move for game.turn. Keeps its transposition table and ordering
+    tables between searches, so searching successive positions of one game is cheaper.
+
+    stop() may be called from another thread; the running search then returns
+    the result of the last completed iteration.
+    """
+
+    def __init__(self, tt_size_bits=18):
+        self.tt = TranspositionTable(tt_size_bits)
+        self.killers = [[0, 0] for _ in range(MAX_PLY)]
+        self.history = [0] * 4096  # (from, to) -> bonus for quiet moves that caused a cutoff
+        self.nodes = 0
+        self.stop_requested = False
+        self.board = None
+        self.deadline = None
+        self.node_limit = None
+        self.stop_check = None
+        self.excluded = set()
+        self.seen_keys = set()
+        self.path = []
+        self.root_best = 0
+
+    def stop(self):
+        self.stop_requested = True
+
+    def search(self, game, max_depth=MAX_PLY - 1, time_limit=None, node_limit=None, on_iteration=None,
+               stop_check=None, exclude=()):
+        """Iterative deepening until max_depth, time_limit (seconds) or node_limit runs out.
+
+        Returns {"move", "uci", "score", "depth", "nodes", "seconds", "nps", "pv"};
+        move is None when the side to move has no legal move (or none outside
+        `exclude`, packed root moves to skip). on_iteration(result) is called after
+        every completed depth; stop_check() returning True ends the search like
+        stop() (e.g. a flag shared with another process).
+        """
+        started = time.perf_counter()
+        board = game.board
+        turn = game.turn
+        ep_index = game.en_passant_index
+        self.board = board
+        self.deadline = started + time_limit if time_limit is not None else None
+        self.node_limit = node_limit
+        self.stop_check = stop_check
+        self.excluded = set(exclude)
+        self.nodes = 0
+        self.stop_requested = False
+        self.seen_keys = set(game.position_counts)  # earlier positions of the game: repeating one scores 0
+        self.path = []
+        self.killers = [[0, 0] for _ in range(MAX_PLY)]
+        self.history = [value >> 2 for value in self.history]
+        base_depth = board.undo_stack.depth
+
+        root_moves = expand_promotions(generate_legal_moves(board, turn, ep_index))
+        if not root_moves:
+            score = -MATE_SCORE if king_in_check(board, turn) else 0
+            return self._result(None, score, 0, [], started)
+        root_moves = [move for move in root_moves if move not in self.excluded]
+        if not root_moves:
+            return self._result(None, 0, 0, [], started)
+
+        result = self._result(root_moves[0], 0, 0, [root_moves[0]], started)
+        for depth in range(1, max_depth + 1):
+            self.root_best = 0
+            try:
+                score = self._negamax(depth, -INFINITY, INFINITY, 0, turn, ep_index)
+            except SearchAborted:
+                while board.undo_stack.depth > base_depth:
+                    board.undo_move(board.undo_stack.pop())
+                break
+            result = self._result(self.root_best, score, depth, self._principal_variation(turn, ep_index), started)
+            if on_iteration is not None:
+                on_iteration(result)
+            if abs(score) >= MATE_BOUND:
+                break
+            # the next iteration would take several times longer than this one
+            if self.deadline is not None and time.perf_counter() - started > (self.deadline - started) / 2:
+                break
+        return result
+
+    def analyze(self, game, lines=3, max_depth=MAX_PLY - 1, time_limit=None, stop_check=None):
+        """The best `lines` moves (multi-PV): each line is a search with the better lines' moves excluded.
+
+        Returns {"lines": [{"uci", "score", "depth", "pv"}, ...], "nodes", "seconds"},
+        best line first; the time limit is split evenly between lines.
+        """
+        started = time.perf_counter()
+        per_line = time_limit / lines if time_limit is not None else None
+        found = []
+        exclude = []
+        nodes = 0
+        for _ in range(lines):
+            result = self.search(game, max_depth, per_line, stop_check=stop_check, exclude=exclude)
+            nodes += result["nodes"]
+            if result["move"] is None:
+                break
+            exclude.append(result["move"])
+            found.append({"uci": result["uci"], "score": result["score"], "depth": result["depth"], "pv": result["pv"]})
+        found.sort(key=lambda line: -line["score"])
+        return {"lines": found, "nodes": nodes, "seconds": time.perf_counter() - started}
+
+    def _result(self, move, score, depth, pv, started):
+        elapsed = time.perf_counter() - started
+        return {
+            "move": move,
+            "uci": move_to_uci(move) if move is not None else None,
+            "score": score,
+            "depth": depth,
+            "nodes": self.nodes,
+            "seconds": elapsed,
+            "nps": self.nodes / elapsed if elapsed > 0 else 0.0,
+            "pv": [move_to_uci(pv_move) for pv_move in pv],
+        }
+
+    def _key(self, turn, ep_index):
+        # same key as Game.position_key
+        return position_key_for(self.board, turn, ep_index)
+
+    def _check_limits(self):
+        if self.stop_requested or (self.stop_check is not None and self.stop_check()):
+            raise SearchAborted()
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchAborted()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchAborted()
+
+    def _make(self, move, turn):
+        board = self.board
+        board.apply_move(move, board.undo_stack.push())
+        next_ep = ((move & 63) + ((move >> 6) & 63)) // 2 if (move >> 12) & 7 == MOVE_DOUBLE_PUSH else None
+        return ("black" if turn == "white" else "white"), next_ep
+
+    def _unmake(self):
+        board = self.board
+        board.undo_move(board.undo_stack.pop())
+
+    def _order(self, moves, tt_move, ply):
+        squares = self.board.squares
+        killers = self.killers[ply]
+        history = self.history
+        scored = []
+        for move in moves:
+            if move == tt_move:
+                score = 1 << 30
+            else:
+                victim = squares[(move >> 6) & 63]
+                if victim != "." or (move >> 12) & 7 == MOVE_EN_PASSANT:
+                    # MVV-LVA: most valuable victim first, then least valuable attacker
+                    victim_value = PIECE_VALUES[victim.lower()] if victim != "." else 100
+                    score = (1 << 28) + victim_value * 16 - PIECE_VALUES[squares[move & 63].lower()] // 16
+                elif move >> 15:
+                    score = (1 << 27) + (move >> 15 == 1)
+                elif move == killers[0] or move == killers[1]:
+                    score = 1 << 26
+                else:
+                    score = history[move & 4095]
+            scored.append((score, move))
+        scored.sort(reverse=True)
+        return [move for _, move in scored]
+
+    def _negamax(self, depth, alpha, beta, ply, turn, ep_index):
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0:
+            self._check_limits()
+
+        key = self._key(turn, ep_index)
+        if ply > 0 and (key in self.seen_keys or key in self.path):
+            return 0
+        if depth <= 0 or ply >= MAX_PLY - 1:
+            return self._quiescence(alpha, beta, ply, turn, ep_index)
+
+        alpha_start = alpha
+        tt_move = 0
+        entry = self.tt.get(key)
+        if entry is not None:
+            tt_move = entry[4]
+            if ply > 0 and entry[1] >= depth:
+                score = _score_from_tt(entry[2], ply)
+                bound = entry[3]
+                if bound == EXACT:
+                    return score
+                if bound == LOWER and score >= beta:
+                    return score
+                if bound == UPPER and score <= alpha:
+                    return score
+
+        moves = expand_promotions(generate_legal_moves(self.board, turn, ep_index))
+        if not moves:
+            return -MATE_SCORE + ply if king_in_check(self.board, turn) else 0
+        if ply == 0 and self.excluded:
+            moves = [move for move in moves if move not in self.excluded]
+
+        best_score = -INFINITY
+        best_move = 0
+        squares = self.board.squares
+        self.path.append(key)
+        for move in self._order(moves, tt_move, ply):
+            quiet = squares[(move >> 6) & 63] == "." and not move >> 15 and (move >> 12) & 7 != MOVE_EN_PASSANT
+            next_turn, next_ep = self._make(move, turn)
+            score = -self._negamax(depth - 1, -beta, -alpha, ply + 1, next_turn, next_ep)
+            self._unmake()
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if ply == 0:
+                    self.root_best = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if quiet:
+                    killers = self.killers[ply]
+                    if killers[0] != move:
+                        killers[1] = killers[0]
+                        killers[0] = move
+                    self.history[move & 4095] += depth * depth
+                break
+        self.path.pop()
+
+        if best_score <= alpha_start:
+            bound = UPPER
+        elif best_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        if ply > 0 or not self.excluded:  # a root searched without its best moves isn't the real root
+            self.tt.put(key, depth, _score_to_tt(best_score, ply), bound, best_move)
+        return best_score
+
+    def _quiescence(self, alpha, beta, ply, turn, ep_index):
+        # only captures and queen promotions, so the static evaluation is taken in a quiet position
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0:
+            self._check_limits()
+
+        stand_pat = evaluate(self.board, turn)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        if ply >= MAX_PLY - 1:
+            return stand_pat
+
+        squares = self.board.squares
+        tactical = []
+        for move in generate_legal_moves(self.board, turn, ep_index):
+            if (move >> 12) & 7 == MOVE_PROMOTION:
+                tactical.append(move | (1 << 15))
+            elif squares[(move >> 6) & 63] != "." or (move >> 12) & 7 == MOVE_EN_PASSANT:
+                tactical.append(move)
+
+        for move in self._order(tactical, 0, ply):
+            next_turn, next_ep = self._make(move, turn)
+            score = -self._quiescence(-beta, -alpha, ply + 1, next_turn, next_ep)
+            self._unmake()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    def _principal_variation(self, turn, ep_index):
+        # the root's best move, then best moves through the transposition table
+        pv = [self.root_best]
+        keys = {self._key(turn, ep_index)}
+        turn, ep_index = self._make(self.root_best, turn)
+        made = 1
+        while len(pv) < MAX_PLY:
+            key = self._key(turn, ep_index)
+            if key in keys:
+                break
+            keys.add(key)
+            entry = self.tt.get(key)
+            if entry is None or not entry[4]:
+                break
+            move = entry[4]
+            legal = expand_promotions(generate_legal_moves(self.board, turn, ep_index))
+            if move not in legal:
+                break
+            pv.append(move)
+            turn, ep_index = self._make(move, turn)
+            made += 1
+        for _ in range(made):
+            self._unmake()
+        return pv
+
+
+def _score_to_tt(score, ply):
+    # mate scores are stored relative to the node, not the root
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def _score_from_tt(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+
+def format_score(score):
+    if score >= MATE_BOUND:
+        return f"mate {(MATE_SCORE - score + 1) // 2}"
+    if score <= -MATE_BOUND:
+        return f"mate -{(MATE_SCORE + score) // 2}"
+    return f"cp {score}"
+
+
+def print_iteration(result, out=sys.stdout):
+    print(f"depth {result['depth']} score {format_score(result['score'])} nodes {result['nodes']} "
+          f"nps {result['nps']:,.0f} time {result['seconds']:.3f}s pv {' '.join(result['pv'])}", file=out)
+
+
+def run_bench(depth, out=sys.stdout):
+    """Fixed-depth search of every perft position with a fresh Searcher. Returns (nodes, seconds)."""
+    from perft import SUITE
+
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, _ in SUITE:
+        result = Searcher().search(Game.from_fen(fen), max_depth=depth)
+        total_nodes += result["nodes"]
+        total_time += result["seconds"]
+        print(f"{name}: bestmove {result['uci']} score {format_score(result['score'])} "
+              f"nodes {result['nodes']} {result['seconds']:.3f}s {result['nps']:,.0f} nodes/s", file=out)
+    nps = total_nodes / total_time if total_time > 0 else 0.0
+    print(f"total: {total_nodes} nodes in {total_time:.3f}s ({nps:,.0f} nodes/s)", file=out)
+    return total_nodes, total_time
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search a position for the best move.")
+    parser.add_argument("--fen", help="position to search (default: start position)")
+    parser.add_argument("--depth", type=int, default=None, help="maximum depth")
+    parser.add_argument("--time", type=float, default=None, help="seconds to think")
+    parser.add_argument("--nodes", type=int, default=None, help="node budget")
+    parser.add_argument("--bench", action="store_true", help="fixed-depth search over the perft positions")
+    parser.add_argument("--debug-eval", action="store_true",
+                        help="re-check the board's running evaluation totals after every move (slow)")
+    args = parser.parse_args(argv)
+    Board.debug_scores = args.debug_eval
+
+    if args.bench:
+        run_bench(args.depth or 4)
+        return 0
+
+    game = Game.from_fen(args.fen or START_FEN)
+    if args.depth is None and args.time is None and args.nodes is None:
+        args.time = 5.0
+    result = Searcher().search(game, max_depth=args.depth or MAX_PLY - 1, time_limit=args.time,
+                               node_limit=args.nodes, on_iteration=print_iteration)
+    print(f"bestmove {result['uci'] or '(none)'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())